@@ -0,0 +1,146 @@
+# analytics.py
+"""Habitudes d'étude d'un serveur : heatmap heure × jour, tendances, ratios.
+
+L'activité d'une fenêtre est lue en une requête (database.fetch_activity),
+chargée dans un tableau NumPy structuré, puis tous les calculs sont vectorisés
+et tournent dans un thread : la boucle du bot n'est jamais bloquée.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+
+import numpy as np
+
+import database
+from database import ACTIVITY_MODES
+
+MAX_DAYS = 366
+WEEKDAYS = ('Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim')
+SHADES = ' ░▒▓█'
+SPARKS = '▁▂▃▄▅▆▇█'
+
+_ROW = np.dtype([('user', 'i8'), ('ts', 'f8'), ('day', 'i8'),
+                 ('mode', 'i1'), ('seconds', 'f8'), ('sessions', 'i8')])
+_WORK = np.array([code for code, mode in enumerate(ACTIVITY_MODES) if not mode.endswith('_break')])
+
+# ─── CALCULS ───────────────────────────────────────────────────────────────────
+def _local(ts: np.ndarray, tz) -> np.ndarray:
+    """Epoch UTC -> secondes « locales » ; un calcul de décalage par heure distincte."""
+    hours, inverse = np.unique(np.floor(ts / 3600).astype(np.int64), return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(int(h) * 3600, tz).utcoffset().total_seconds()
+                        for h in hours], dtype=np.float64)
+    return ts + offsets[inverse]
+
+def heatmap(ts: np.ndarray, seconds: np.ndarray, tz) -> np.ndarray:
+    """Secondes par (jour de semaine, heure locale), tableau 7×24, lundi en premier.
+
+    `ts` est la fin de chaque session : sa durée est répartie sur toutes les
+    heures qu'elle couvre, au prorata.
+    """
+    out = np.zeros(7 * 24)
+    keep = seconds > 0
+    if not keep.any():
+        return out.reshape(7, 24)
+    end = _local(ts[keep], tz)
+    start = end - seconds[keep]
+    first = np.floor(start / 3600).astype(np.int64)
+    spans = np.ceil(end / 3600).astype(np.int64) - first
+    spans = np.maximum(spans, 1)
+
+    # Une ligne par (session, heure couverte)
+    owner = np.repeat(np.arange(len(spans)), spans)
+    hour = first[owner] + np.arange(owner.size) - np.repeat(np.cumsum(spans) - spans, spans)
+    overlap = (np.minimum(end[owner], (hour + 1) * 3600.0)
+               - np.maximum(start[owner], hour * 3600.0))
+    # 1970-01-01 était un jeudi : (jour + 3) % 7 donne 0 pour lundi
+    slot = ((hour // 24 + 3) % 7) * 24 + hour % 24
+    return np.bincount(slot, weights=np.maximum(overlap, 0), minlength=7 * 24).reshape(7, 24)
+
+def rolling_mean(values: np.ndarray, window: int = 7) -> np.ndarray:
+    if values.size < window:
+        return values.copy()
+    return np.convolve(values, np.ones(window) / window, mode='valid')
+
+def summarize(rows: list, tz, today: int, days: int) -> dict:
+    """Toutes les analyses d'une fenêtre ; pur calcul, à lancer via asyncio.to_thread."""
+    started = time.perf_counter()
+    data = np.array(rows, dtype=_ROW)
+    work = np.isin(data['mode'], _WORK)
+    raw = data['ts'] >= 0
+
+    # Heatmap : seuls les logs bruts ont une heure (les agrégats n'ont qu'un jour)
+    heat = heatmap(data['ts'][work & raw], data['seconds'][work & raw], tz)
+
+    # Travail par jour local, jours vides compris
+    offset = data['day'] - (today - days + 1)
+    in_window = work & (offset >= 0) & (offset < days)
+    daily = np.bincount(offset[in_window], weights=data['seconds'][in_window], minlength=days)
+    rolling = rolling_mean(daily)
+    last_week, prev_week = daily[-7:].sum(), daily[-14:-7].sum()
+
+    # Ratios travail / pause par mode
+    known = data['mode'] >= 0
+    by_mode = np.bincount(data['mode'][known], weights=data['seconds'][known], minlength=len(ACTIVITY_MODES))
+    sessions = np.bincount(data['mode'][known], weights=data['sessions'][known], minlength=len(ACTIVITY_MODES))
+    totals = dict(zip(ACTIVITY_MODES, by_mode))
+    ratios = {mode: (totals[mode] / totals[f'{mode}_break'] if totals[f'{mode}_break'] else None)
+              for mode in ('A', 'B')}
+
+    # Répartition du travail entre utilisateurs
+    users, inverse = np.unique(data['user'][work], return_inverse=True)
+    per_user = np.bincount(inverse, weights=data['seconds'][work], minlength=users.size)
+    per_user = np.sort(per_user[per_user > 0])[::-1]
+    if per_user.size:
+        p25, p50, p75, p90 = np.percentile(per_user, [25, 50, 75, 90])
+        top = max(1, int(np.ceil(per_user.size * 0.1)))
+        distribution = {'users': int(per_user.size), 'p25': p25, 'p50': p50, 'p75': p75, 'p90': p90,
+                        'max': per_user[0], 'top10_share': per_user[:top].sum() / per_user.sum()}
+    else:
+        distribution = {'users': 0}
+
+    peak = np.unravel_index(np.argmax(heat), heat.shape) if heat.any() else None
+    return {
+        'rows': int(data.size),
+        'raw_rows': int(raw.sum()),
+        'heatmap': heat,
+        'peak': peak,  # (jour de semaine, heure) ou None
+        'daily': daily,
+        'rolling': rolling,
+        'trend': (last_week - prev_week) / prev_week if prev_week else None,
+        'mode_seconds': totals,
+        'mode_sessions': dict(zip(ACTIVITY_MODES, sessions.astype(int))),
+        'ratios': ratios,
+        'distribution': distribution,
+        'elapsed': time.perf_counter() - started,
+    }
+
+async def guild_analytics(guild_id: int, days: int = 90) -> dict:
+    days = max(7, min(days, MAX_DAYS))
+    tz = await database.get_guild_timezone(guild_id)
+    today = database.day_bucket(time.time(), tz)
+    rows = await database.fetch_activity(guild_id, days)
+    result = await asyncio.to_thread(summarize, rows, tz, today, days)
+    result['days'] = days
+    return result
+
+# ─── RENDU TEXTE ───────────────────────────────────────────────────────────────
+def render_heatmap(heat: np.ndarray) -> str:
+    """7 lignes de 24 cases, nuance proportionnelle au maximum."""
+    top = heat.max()
+    levels = np.zeros(heat.shape, dtype=int) if top == 0 else \
+        np.ceil(heat / top * (len(SHADES) - 1)).astype(int)
+    lines = ["    0     6     12    18   "]
+    for name, row in zip(WEEKDAYS, levels):
+        lines.append(f"{name} " + ''.join(SHADES[level] for level in row))
+    return "\n".join(lines)
+
+def sparkline(values: np.ndarray, width: int = 60) -> str:
+    if values.size == 0:
+        return ''
+    if values.size > width:
+        values = np.array([chunk.mean() for chunk in np.array_split(values, width)])
+    top = values.max()
+    if top == 0:
+        return SPARKS[0] * values.size
+    return ''.join(SPARKS[i] for i in np.round(values / top * (len(SPARKS) - 1)).astype(int))
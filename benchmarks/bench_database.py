@@ -0,0 +1,245 @@
+# benchmarks/bench_database.py
+"""Micro-benchmarks des chemins chauds de database.py.
+
+Remplit une base temporaire (serveurs, utilisateurs, années de session_logs),
+mesure débit (ops/s) et latences p50/p99 de chaque opération, seule puis sous
+charge concurrente, et écrit le résultat en JSON. Avec --baseline, compare à
+un run précédent et sort en erreur si une opération a régressé.
+
+    python benchmarks/bench_database.py --output bench.json
+    python benchmarks/bench_database.py --baseline bench.json --output new.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# ─── PARAMÈTRES ────────────────────────────────────────────────────────────────
+def parse_args():
+    p = argparse.ArgumentParser(description="Benchmarks de database.py")
+    p.add_argument('--guilds', type=int, default=3)
+    p.add_argument('--users', type=int, default=200, help="utilisateurs par serveur")
+    p.add_argument('--years', type=float, default=1.0, help="années d'historique session_logs")
+    p.add_argument('--sessions-per-day', type=int, default=2, help="logs par utilisateur actif et par jour")
+    p.add_argument('--activity', type=float, default=0.3, help="part des utilisateurs actifs chaque jour")
+    p.add_argument('--ops', type=int, default=500, help="opérations mesurées par benchmark")
+    p.add_argument('--concurrency', type=int, default=20, help="opérations simultanées en mode concurrent")
+    p.add_argument('--only', nargs='*', help="noms des benchmarks à lancer")
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--output', type=Path, help="fichier JSON des résultats")
+    p.add_argument('--baseline', type=Path, help="résultats de référence à comparer")
+    p.add_argument('--tolerance', type=float, default=0.15,
+                   help="régression tolérée (0.15 = 15 %% de débit en moins ou de p99 en plus)")
+    p.add_argument('--noise-ms', type=float, default=0.05,
+                   help="écart absolu de latence en dessous duquel on ne conclut pas")
+    return p.parse_args()
+
+# ─── REMPLISSAGE ───────────────────────────────────────────────────────────────
+async def seed(db_module, args, rng: random.Random) -> dict:
+    """Remplit la base directement (sans passer par le tampon) ; renvoie les volumes."""
+    d = db_module
+    tz = d.TIMEZONE
+    now = datetime.now(timezone.utc).timestamp()
+    days = int(args.years * 365)
+    guilds = list(range(1, args.guilds + 1))
+    counts = {'stats': 0, 'session_logs': 0, 'streaks': 0}
+
+    async with d._db.writer() as db:
+        for guild_id in guilds:
+            users = range(1, args.users + 1)
+            logs, totals = [], {}
+            for offset in range(days, 0, -1):
+                base = now - offset * 86400
+                day = d.day_bucket(base, tz)
+                for user_id in users:
+                    if rng.random() >= args.activity:
+                        continue
+                    for k in range(args.sessions_per_day):
+                        mode = rng.choice(('A', 'B'))
+                        duration = 3000 if mode == 'A' else 1500
+                        logs.append((guild_id, user_id, base + k * 3600 + user_id / 1000, mode,
+                                     duration, day, d.week_bucket(day)))
+                        acc = totals.setdefault(user_id, {'A': 0, 'B': 0, 'n': 0})
+                        acc[mode] += duration
+                        acc['n'] += 1
+                if len(logs) >= 50000:
+                    await db.executemany(d._INSERT_LOG, logs)
+                    counts['session_logs'] += len(logs)
+                    logs = []
+            await db.executemany(d._INSERT_LOG, logs)
+            counts['session_logs'] += len(logs)
+
+            await db.executemany(d._UPSERT_STATS, [
+                (guild_id, user_id, t['A'] + t['B'], t['A'] + t['B'], t['A'], 0, t['B'], 0, t['n'])
+                for user_id, t in totals.items()
+            ])
+            counts['stats'] += len(totals)
+            today = d.day_bucket(now, tz)
+            streaks = [(guild_id, user_id, rng.randint(1, 30), rng.randint(30, 90), today - rng.randint(0, 5))
+                       for user_id in totals]
+            await db.executemany("""
+                INSERT OR REPLACE INTO streaks(guild_id, user_id, current_streak, best_streak, last_day)
+                VALUES (?, ?, ?, ?, ?)
+            """, streaks)
+            counts['streaks'] += len(streaks)
+            await db.execute("""
+                INSERT OR REPLACE INTO settings(guild_id, key, value) VALUES (?, 'channel_id', ?)
+            """, (guild_id, 1000 + guild_id))
+        await db.execute("ANALYZE")
+    await d._settings.load()
+    return counts
+
+# ─── MESURE ────────────────────────────────────────────────────────────────────
+def percentile(ordered: list, q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    ordered = sorted(latencies)
+    return {
+        'ops': len(ordered),
+        'ops_per_sec': round(len(ordered) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+    }
+
+async def measure(op, n: int, concurrency: int) -> dict:
+    latencies = []
+
+    async def timed():
+        start = time.perf_counter()
+        await op()
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    if concurrency <= 1:
+        for _ in range(n):
+            await timed()
+    else:
+        slots = asyncio.Semaphore(concurrency)
+
+        async def worker():
+            async with slots:
+                await timed()
+
+        await asyncio.gather(*(worker() for _ in range(n)))
+    return summarize(latencies, time.perf_counter() - start)
+
+def build_ops(d, args, rng: random.Random) -> dict:
+    guilds = list(range(1, args.guilds + 1))
+
+    def guild():
+        return rng.choice(guilds)
+
+    def user():
+        return rng.randint(1, args.users)
+
+    return {
+        'ajouter_temps':       lambda: d.ajouter_temps(user(), guild(), 1500, 'A', True),
+        'get_all_stats':       lambda: d.get_all_stats(guild()),
+        'classement_top10':    lambda: d.classement_top10(guild()),
+        'get_daily_totals':    lambda: d.get_daily_totals(guild()),
+        'get_weekly_sessions': lambda: d.get_weekly_sessions(guild()),
+        'update_streak':       lambda: d.update_streak(guild(), user()),
+        'get_setting':         lambda: d.get_setting(guild(), 'channel_id'),
+        'get_ranks':           lambda: d.get_ranks(guild(), user()),
+    }
+
+# ─── COMPARAISON ───────────────────────────────────────────────────────────────
+def compare(results: dict, baseline: dict, tolerance: float, noise_ms: float) -> list:
+    """Lignes de comparaison ; la dernière colonne vaut True en cas de régression."""
+    rows = []
+    for name, modes in results.items():
+        for mode, now in modes.items():
+            ref = baseline.get(name, {}).get(mode)
+            if ref is None:
+                continue
+            speed = now['ops_per_sec'] / ref['ops_per_sec'] if ref['ops_per_sec'] else 1.0
+            tail = now['p99_ms'] / ref['p99_ms'] if ref['p99_ms'] else 1.0
+            # Les opérations en mémoire durent quelques µs : un ratio seul n'y veut rien dire
+            slower = speed < 1 - tolerance and now['mean_ms'] - ref['mean_ms'] > noise_ms
+            longer_tail = tail > 1 + tolerance and now['p99_ms'] - ref['p99_ms'] > noise_ms
+            regressed = slower or longer_tail
+            rows.append((name, mode, speed, tail, regressed))
+    return rows
+
+# ─── PROGRAMME ─────────────────────────────────────────────────────────────────
+async def run(args) -> dict:
+    import database as d
+
+    rng = random.Random(args.seed)
+    await d.init_db()
+    try:
+        t0 = time.perf_counter()
+        counts = await seed(d, args, rng)
+        print(f"Base remplie en {time.perf_counter() - t0:.1f}s : {counts}")
+
+        results = {}
+        for name, op in build_ops(d, args, rng).items():
+            if args.only and name not in args.only:
+                continue
+            await op()  # échauffement (caches, TopK)
+            results[name] = {
+                'single': await measure(op, args.ops, 1),
+                'concurrent': await measure(op, args.ops, args.concurrency),
+            }
+            s, c = results[name]['single'], results[name]['concurrent']
+            print(f"{name:<20} seul {s['ops_per_sec']:>9.1f} ops/s p50 {s['p50_ms']:>7.3f}ms p99 {s['p99_ms']:>7.3f}ms"
+                  f" | x{args.concurrency} {c['ops_per_sec']:>9.1f} ops/s p50 {c['p50_ms']:>7.3f}ms p99 {c['p99_ms']:>7.3f}ms")
+        await d.flush_writes()
+    finally:
+        await d.close_db()
+    return {'counts': counts, 'results': results}
+
+def main():
+    args = parse_args()
+    # database.py lit settings.ini et DATA_DIR à l'import : base jetable, racine du dépôt
+    tmp = tempfile.TemporaryDirectory(prefix='pomobot-bench-')
+    os.environ['POMOBOT_DATA_DIR'] = tmp.name
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+
+    try:
+        out = asyncio.run(run(args))
+    finally:
+        tmp.cleanup()
+
+    report = {
+        'meta': {
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            'params': {k: v for k, v in vars(args).items()
+                       if k not in ('output', 'baseline', 'only', 'tolerance', 'noise_ms')},
+        },
+        **out,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding='utf-8')
+        print(f"Résultats écrits dans {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        if baseline.get('meta', {}).get('params') != report['meta']['params']:
+            print("⚠️ Paramètres différents de la référence : comparaison indicative.")
+        rows = compare(report['results'], baseline.get('results', {}), args.tolerance, args.noise_ms)
+        for name, mode, speed, tail, regressed in rows:
+            flag = "RÉGRESSION" if regressed else "ok"
+            print(f"{name:<20} {mode:<10} débit x{speed:.2f}  p99 x{tail:.2f}  {flag}")
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
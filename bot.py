@@ -4,30 +4,59 @@ from dotenv import load_dotenv
 import os
 import sys
 import asyncio
+import subprocess
+import time
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 import configparser
 import logging
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-import aiosqlite
 import messages
+from embed_cache import EmbedCache
+from scheduler import Cycle, PhaseScheduler
+from usernames import NameResolver
+from roles import RoleQueue
+from dispatcher import Dispatcher
+import perf
+import profiling
+import export
+import analytics
 from database import (
-    DB_PATH,
     init_db,
+    close_db,
     ajouter_temps,
+    ajouter_temps_many,
+    get_user_profile,
+    get_ranks,
     get_all_stats,
     classement_top10,
+    get_top,
+    get_leaderboard_page,
+    LEADERBOARD_METRICS,
+    get_generation,
+    get_guild_timezone,
     add_participant,
     remove_participant,
+    remove_all_participants,
     get_all_participants,
+    load_all_participants,
     get_daily_totals,
     get_weekly_sessions,
-    get_streak,
     top_streaks,
-    get_setting,
+    rebuild_streaks,
+    clear_guild_stats,
     set_setting,
+    get_maintenance,
+    get_channel_id,
+    get_role_setting,
+    set_role_setting,
+    get_cycle_minutes,
+    set_maintenance,
+    set_checkpoint_avoid_minutes,
+    get_heartbeat,
+    set_heartbeat,
     timedelta,
 )
 
@@ -37,19 +66,53 @@ config = configparser.ConfigParser()
 config.read('settings.ini')
 
 TOKEN               = os.getenv('DISCORD_TOKEN')
-WORK_TIME_A         = config['CURRENT_SETTINGS'].getint('work_time_A', fallback=50)
-BREAK_TIME_A        = config['CURRENT_SETTINGS'].getint('break_time_A', fallback=10)
-POMO_ROLE_A         = config['CURRENT_SETTINGS'].get('pomodoro_role_A', fallback='50-10')
-WORK_TIME_B         = config['CURRENT_SETTINGS'].getint('work_time_B', fallback=25)
-BREAK_TIME_B        = config['CURRENT_SETTINGS'].getint('break_time_B', fallback=5)
-POMO_ROLE_B         = config['CURRENT_SETTINGS'].get('pomodoro_role_B', fallback='25-5')
-POMODORO_CHANNEL_ID = config['CURRENT_SETTINGS'].getint('channel_id', fallback=None)
 PREFIX              = config['CURRENT_SETTINGS'].get('prefix', '*')
-MAINTENANCE_MODE    = False
+DEFAULT_CHANNEL_ID  = config['CURRENT_SETTINGS'].getint('channel_id', fallback=None)
+TICK_CONCURRENCY    = int(os.getenv('POMOBOT_TICK_CONCURRENCY', '20'))
+ROLE_CONCURRENCY    = int(os.getenv('POMOBOT_ROLE_CONCURRENCY', '4'))  # appels de rôles simultanés par serveur
+ANNOUNCE_TIMEOUT    = 30  # secondes max pour l'annonce d'un serveur
+SEND_RATE           = float(os.getenv('POMOBOT_SEND_RATE', '1'))  # messages/s par salon
+SEND_BURST          = int(os.getenv('POMOBOT_SEND_BURST', '5'))
+METRICS_PORT        = int(os.getenv('POMOBOT_METRICS_PORT', '8080'))  # 0 = pas d'export Prometheus
+ANNOUNCE_MAX_LATE   = 120 # au-delà, une bascule rattrapée est créditée sans annonce
+# Redémarrage : 'credit' (bascules manquées créditées), 'skip' (rien) ou 'end' (sessions closes)
+DOWNTIME_POLICY     = os.getenv('POMOBOT_DOWNTIME_POLICY', 'credit')
+DOWNTIME_MAX_GAP    = int(os.getenv('POMOBOT_DOWNTIME_MAX_GAP', '3600'))  # au-delà : 'end'
+
+def read_build_info() -> tuple:
+    """(SHA git court, contenu de VERSION), lus une fois au démarrage."""
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        out = ''
+    try:
+        with open("VERSION", encoding="utf-8") as f:
+            file_ver = f.read().strip()
+    except FileNotFoundError:
+        file_ver = "unknown"
+    return out or "unknown", file_ver
+
+# `update` redémarre le processus : la version affichée par status ne change qu'au démarrage
+GIT_SHA, FILE_VERSION = read_build_info()
+
+# Table des cycles, partagée par le planificateur, les phases affichées et les checkpoints.
+# Durées lues dans le store de réglages (settings.ini tant que la base n'est pas ouverte),
+# puis relues par load_schedule() après init_db.
+SCHEDULE = {mode: Cycle(mode, *get_cycle_minutes(mode)) for mode in ('A', 'B')}
+
+class PomodoroContext(commands.Context):
+    """Contexte dont les réponses passent par le répartiteur sortant."""
+    async def send(self, content=None, **kwargs):
+        return await OUTBOX.send(self.channel, content, **kwargs)
+
+class PomodoroBot(commands.Bot):
+    async def get_context(self, origin, *, cls=PomodoroContext):
+        return await super().get_context(origin, cls=cls)
 
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(
+bot = PomodoroBot(
     command_prefix=PREFIX,
     help_command=None,
     intents=intents,
@@ -66,8 +129,82 @@ fh.setFormatter(logging.Formatter(
 logger.addHandler(fh)
 
 # ─── ÉTAT EN MÉMOIRE ────────────────────────────────────────────────────────────
-PARTICIPANTS_A = set()
-PARTICIPANTS_B = set()
+MODES = ('A', 'B')
+
+class GuildSession:
+    """État Pomodoro d'un serveur : participants en cours et configuration."""
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.participants = {mode: set() for mode in MODES}
+        # Résolutions mises en cache (0 = introuvable), vidées par invalidate()
+        self._role_ids = {}      # mode -> role_id
+        self._channel_id = None
+
+    def invalidate(self):
+        """À appeler quand un rôle ou salon du serveur change (événements, def*)."""
+        self._role_ids.clear()
+        self._channel_id = None
+
+    # La configuration vit dans le store de réglages (database) : lecture sans I/O
+    @property
+    def channel_id(self):
+        if self._channel_id is None:
+            channel_id = get_channel_id(self.guild_id)
+            if channel_id is None and DEFAULT_CHANNEL_ID:
+                # Le canal de settings.ini ne vaut que pour le serveur qui le contient
+                chan = bot.get_channel(DEFAULT_CHANNEL_ID)
+                if chan and chan.guild.id == self.guild_id:
+                    channel_id = DEFAULT_CHANNEL_ID
+            self._channel_id = channel_id or 0
+        return self._channel_id or None
+
+    @property
+    def channel(self):
+        channel_id = self.channel_id
+        return bot.get_channel(channel_id) if channel_id else None
+
+    @property
+    def role_names(self) -> dict:
+        return {mode: get_role_setting(self.guild_id, mode)[1] for mode in MODES}
+
+    def role(self, guild: discord.Guild, mode: str):
+        """Rôle d'un mode : par ID enregistré, sinon par nom (résolu une fois)."""
+        role_id = self._role_ids.get(mode)
+        if role_id is None:
+            stored_id, name = get_role_setting(self.guild_id, mode)
+            role = guild.get_role(stored_id) if stored_id else None
+            role = role or discord.utils.get(guild.roles, name=name)
+            role_id = self._role_ids[mode] = role.id if role else 0
+        return guild.get_role(role_id) if role_id else None
+
+    def mode_of(self, user_id: int):
+        for mode, users in self.participants.items():
+            if user_id in users:
+                return mode
+        return None
+
+    def has_participants(self) -> bool:
+        return any(self.participants.values())
+
+SESSIONS = {}  # guild_id -> GuildSession
+
+def get_session(guild_id: int) -> GuildSession:
+    session = SESSIONS.get(guild_id)
+    if session is None:
+        session = SESSIONS[guild_id] = GuildSession(guild_id)
+    return session
+
+NAMES = NameResolver(bot)
+EMBEDS = EmbedCache()
+ROLES = RoleQueue(bot, ROLE_CONCURRENCY)
+OUTBOX = Dispatcher(SEND_RATE, SEND_BURST)
+
+# Mesures exportées avec les histogrammes (voir perf.py)
+perf.instrument_http(bot.http)
+perf.gauge('outbox_depth', OUTBOX.depth)
+perf.gauge('role_queue_pending', ROLES.pending)
+perf.gauge('active_participants', lambda: sum(len(u) for s in SESSIONS.values() for u in s.participants.values()))
 
 # ─── EXCEPTIONS PERSONNALISÉES ──────────────────────────────────────────────────
 class SetupIncomplete(commands.CommandError):
@@ -84,7 +221,7 @@ def is_admin():
 
 def check_maintenance():
     async def predicate(ctx):
-        if MAINTENANCE_MODE and ctx.command.name != 'maintenance':
+        if ctx.command.name != 'maintenance' and get_maintenance(ctx.guild.id):
             raise commands.CommandError("Bot en mode maintenance.")
         return True
     return commands.check(predicate)
@@ -92,9 +229,10 @@ def check_maintenance():
 def check_setup():
     async def predicate(ctx):
         guild = ctx.guild
-        channel_ok = POMODORO_CHANNEL_ID and bot.get_channel(POMODORO_CHANNEL_ID)
-        roleA_ok = discord.utils.get(guild.roles, name=POMO_ROLE_A)
-        roleB_ok = discord.utils.get(guild.roles, name=POMO_ROLE_B)
+        session = get_session(guild.id)
+        channel_ok = session.channel
+        roleA_ok = session.role(guild, 'A')
+        roleB_ok = session.role(guild, 'B')
         if channel_ok and roleA_ok and roleB_ok:
             return True
         raise SetupIncomplete()
@@ -104,33 +242,39 @@ def check_channel():
     async def predicate(ctx):
         if ctx.author.guild_permissions.administrator or ctx.command.name in ('status','help','update','me'):
             return True
-        if ctx.channel.id == POMODORO_CHANNEL_ID:
+        if ctx.channel.id == get_session(ctx.guild.id).channel_id:
             return True
         raise WrongChannel()
     return commands.check(predicate)
 
-async def ensure_role(guild: discord.Guild, name: str) -> discord.Role:
-    role = discord.utils.get(guild.roles, name=name)
+async def ensure_role(guild: discord.Guild, mode: str) -> discord.Role:
+    session = get_session(guild.id)
+    role = session.role(guild, mode)
     if role is None:
+        name = session.role_names[mode]
         role = await guild.create_role(name=name, colour=discord.Colour(0x206694))
+        await set_role_setting(guild.id, mode, role.id, role.name)
+        session.invalidate()
         logger.info(f"Rôle '{name}' créé dans '{guild.name}'")
     return role
 
 def get_phase_and_remaining(now: datetime, mode: str) -> tuple[str,int]:
-    m, sec = now.minute, now.second
-    if mode == 'A':
-        if m < 50:
-            return 'travail', (50-m)*60 - sec
-        return 'pause', (60-m)*60 - sec
-    if mode == 'B':
-        if m < 25:
-            return 'travail', (25-m)*60 - sec
-        if m < 30:
-            return 'pause', (30-m)*60 - sec
-        if m < 55:
-            return 'travail', (55-m)*60 - sec
-        return 'pause', (60-m)*60 - sec
-    return 'travail', 0
+    cycle = SCHEDULE.get(mode)
+    if cycle is None:
+        return 'travail', 0
+    return cycle.phase_at(now.timestamp())
+
+def phase_message(boundary) -> str:
+    cycle = SCHEDULE[boundary.mode]
+    if boundary.phase == 'travail':
+        label = ("début travail" if boundary.index == 0 else
+                 "deuxième travail" if boundary.index == 1 else
+                 f"travail {boundary.index + 1}")
+        return f"🔔 Mode {boundary.mode} : {label} ({cycle.work} min)"
+    label = ("début pause" if boundary.per_hour == 1 else
+             "pause finale" if boundary.index == boundary.per_hour - 1 else
+             f"pause {boundary.index + 1}")
+    return f"☕ Mode {boundary.mode} : {label} ({cycle.brk} min)"
 
 def format_duration(seconds: int) -> str:
     """Retourne un temps formaté (ex: '1h14m35s', '2j 3h 5m')."""
@@ -152,82 +296,194 @@ def format_duration(seconds: int) -> str:
     return " ".join(parts) if parts else "0s"
 
 # ─── BOUCLE POMODORO ──────────────────────────────────────────────────────────
-@tasks.loop(minutes=1)
-async def pomodoro_loop():
-    if POMODORO_CHANNEL_ID is None:
-        return
-
-    now    = datetime.now(timezone.utc)
-    minute = now.minute
-    chan   = bot.get_channel(POMODORO_CHANNEL_ID)
+async def announce(session: GuildSession, chan, boundaries: list):
+    """Annonces de phase, mises en file : un seul message par instant de bascule.
+
+    Les rôles de tous les modes sont résolus avant la moindre mise en file, pour
+    que les annonces A et B d'un même tick partent ensemble.
+    """
+    lines = {}  # ts -> lignes du message
+    for boundary in boundaries:
+        try:
+            role = await asyncio.wait_for(ensure_role(chan.guild, boundary.mode), ANNOUNCE_TIMEOUT)
+        except (asyncio.TimeoutError, discord.HTTPException) as exc:
+            logger.warning(f"Annonce {boundary.mode} impossible sur le serveur {session.guild_id} : {exc!r}")
+            continue
+        lines.setdefault(boundary.ts, []).append(f"{phase_message(boundary)} {role.mention}")
+    for ts, parts in sorted(lines.items()):
+        OUTBOX.post(chan, "\n".join(parts), merge_key=ts, deadline=ts + ANNOUNCE_MAX_LATE)
+
+async def tick_guild(session: GuildSession, due: list):
+    chan = session.channel
     if not chan:
         return
 
     # 🔒 Stopper si maintenance activée
-    if await get_maintenance(chan.guild.id):
+    if get_maintenance(session.guild_id):
         return
 
-    # Mode A
-    if PARTICIPANTS_A:
-        mention = (await ensure_role(chan.guild, POMO_ROLE_A)).mention
-        if minute == 0:
-            for uid in PARTICIPANTS_A:
-                await ajouter_temps(uid, chan.guild.id, BREAK_TIME_A*60, mode='A_break')
-            await chan.send(f"🔔 Mode A : début travail ({WORK_TIME_A} min) {mention}")
-        elif minute == WORK_TIME_A:
-            for uid in PARTICIPANTS_A:
-                await ajouter_temps(uid, chan.guild.id, WORK_TIME_A*60, mode='A', is_session_end=True)
-            await chan.send(f"☕ Mode A : début pause ({BREAK_TIME_A} min) {mention}")
-
-    # Mode B
-    if PARTICIPANTS_B:
-        mention = (await ensure_role(chan.guild, POMO_ROLE_B)).mention
-        if minute == 0:
-            for uid in PARTICIPANTS_B:
-                await ajouter_temps(uid, chan.guild.id, BREAK_TIME_B*60, mode='B_break')
-            await chan.send(f"🔔 Mode B : début travail ({WORK_TIME_B} min) {mention}")
-        elif minute == WORK_TIME_B:
-            for uid in PARTICIPANTS_B:
-                await ajouter_temps(uid, chan.guild.id, WORK_TIME_B*60, mode='B', is_session_end=True)
-            await chan.send(f"☕ Mode B : pause 1 ({BREAK_TIME_B} min) {mention}")
-        elif minute == WORK_TIME_B + BREAK_TIME_B:
-            for uid in PARTICIPANTS_B:
-                await ajouter_temps(uid, chan.guild.id, BREAK_TIME_B*60, mode='B_break')
-            await chan.send(f"🔔 Mode B : deuxième travail ({WORK_TIME_B} min) {mention}")
-        elif minute == 2*WORK_TIME_B + BREAK_TIME_B:
-            for uid in PARTICIPANTS_B:
-                await ajouter_temps(uid, chan.guild.id, WORK_TIME_B*60, mode='B', is_session_end=True)
-            await chan.send(f"☕ Mode B : pause finale ({BREAK_TIME_B} min) {mention}")
+    due = [boundary for boundary in due if session.participants[boundary.mode]]
+
+    # Crédits calculés sur les participants présents à la bascule...
+    batches = []
+    for boundary in due:
+        users = list(session.participants[boundary.mode])
+        cycle = SCHEDULE[boundary.mode]
+        if boundary.phase == 'travail':
+            # Début de travail : la pause qui vient de finir est créditée
+            batches.append([(uid, cycle.brk*60, f'{boundary.mode}_break', False) for uid in users])
+        else:
+            batches.append([(uid, cycle.work*60, boundary.mode, True) for uid in users])
+
+    # ...mais annoncés d'abord : l'annonce n'attend pas l'écriture du journal des
+    # serveurs tombés sur la même bascule. Après un retard, seule la dernière
+    # bascule de chaque mode est annoncée.
+    latest = {boundary.mode: boundary for boundary in due}
+    now = time.time()
+    await announce(session, chan, [boundary for boundary in latest.values()
+                                   if now - boundary.ts <= ANNOUNCE_MAX_LATE])
+
+    # Puis écrits (mémoire + journal)
+    for credits in batches:
+        await ajouter_temps_many(session.guild_id, credits)
+
+async def on_boundaries(due: list):
+    # Tous les serveurs en parallèle, avec un nombre borné de ticks simultanés
+    slots = asyncio.Semaphore(TICK_CONCURRENCY)
+
+    async def run(session):
+        async with slots:
+            try:
+                with perf.timer('tick', 'guild'):
+                    await tick_guild(session, due)
+            except Exception:
+                perf.inc('tick_errors')
+                logger.exception(f"Tick échoué pour le serveur {session.guild_id}")
+
+    with perf.timer('tick', 'all'):
+        await asyncio.gather(*(run(s) for s in list(SESSIONS.values()) if s.has_participants()))
+    perf.observe('tick', 'lateness', pomodoro_scheduler.last_lateness)
+    await set_heartbeat(time.time())
+
+pomodoro_scheduler = PhaseScheduler(SCHEDULE.values(), on_boundaries)
+set_checkpoint_avoid_minutes(pomodoro_scheduler.minutes())
+
+def load_schedule():
+    """Relit les durées des cycles dans le store de réglages (après init_db)."""
+    for mode in MODES:
+        SCHEDULE[mode] = Cycle(mode, *get_cycle_minutes(mode))
+    pomodoro_scheduler.cycles = list(SCHEDULE.values())
+    set_checkpoint_avoid_minutes(pomodoro_scheduler.minutes())
+
+# ─── REDÉMARRAGE À CHAUD ───────────────────────────────────────────────────────
+async def reconcile_roles(guild: discord.Guild, session: GuildSession):
+    """Aligne les rôles A/B sur les participants : seules les différences sont appliquées."""
+    for mode in MODES:
+        role = session.role(guild, mode)
+        if role is None:
+            continue
+        wanted = session.participants[mode]
+        ROLES.clear_role(role, keep=wanted)
+        for user_id in wanted - {member.id for member in role.members}:
+            ROLES.add(guild.id, user_id, role)
+
+async def warm_restart() -> float:
+    """Recharge les sessions depuis la table participants après un redémarrage.
+
+    Renvoie l'instant jusqu'auquel les bascules ont été traitées : le planificateur
+    doit repartir de là, sinon celles survenues pendant la restauration sont perdues.
+    """
+    now = time.time()
+    heartbeat = await get_heartbeat() or now
+    gap = now - heartbeat
+    policy = DOWNTIME_POLICY if gap <= DOWNTIME_MAX_GAP else 'end'
+
+    by_guild = {}
+    for guild_id, user_id, join_ts, mode in await load_all_participants():
+        by_guild.setdefault(guild_id, []).append((user_id, join_ts, mode))
+
+    restored = 0
+    for guild in bot.guilds:
+        session = get_session(guild.id)
+        for users in session.participants.values():
+            users.clear()
+        rows = by_guild.get(guild.id, [])
+        if policy == 'end' and rows:
+            # Interruption trop longue : sessions closes au dernier signe de vie
+            await remove_all_participants(guild.id)
+            await ajouter_temps_many(guild.id, [
+                (user_id, max(0, int(heartbeat - join_ts)), mode, True) for user_id, join_ts, mode in rows
+            ])
+        else:
+            for user_id, _, mode in rows:
+                if mode in session.participants:
+                    session.participants[mode].add(user_id)
+                    restored += 1
+        await reconcile_roles(guild, session)
+
+    if policy == 'credit':
+        missed = pomodoro_scheduler.boundaries(heartbeat, now)
+        if missed:
+            await on_boundaries(missed)
+    logger.info(f"Redémarrage à chaud : {restored} participant(s) restauré(s), "
+                f"interruption {gap:.0f}s, politique '{policy}'.")
+    return now
+
+_restored = False
 
 # ─── ÉVÉNEMENTS ────────────────────────────────────────────────────────────────
 @bot.event
 async def on_ready():
+    global _restored
     logger.info(f"{bot.user} connecté.")
-    await init_db()
-    # Ne pas recharger PARTICIPANTS depuis la DB
-    PARTICIPANTS_A.clear()
-    PARTICIPANTS_B.clear()
-    # Optionnel : enlever tous les rôles A/B du serveur au boot
-    for guild in bot.guilds:
-        roleA = discord.utils.get(guild.roles, name=POMO_ROLE_A)
-        roleB = discord.utils.get(guild.roles, name=POMO_ROLE_B)
-        if roleA:
-            for member in roleA.members:
-                await member.remove_roles(roleA)
-        if roleB:
-            for member in roleB.members:
-                await member.remove_roles(roleB)
-    logger.info("Tous les participants réinitialisés après redémarrage.")
+    # on_ready est rappelé à chaque reconnexion : une seule restauration par processus
+    since = None
+    if not _restored:
+        _restored = True
+        since = await warm_restart()
+    pomodoro_scheduler.start(since)
+
+# Rôles et salons résolus en cache (GuildSession) : toute modification les invalide
+def _forget_resolutions(guild: discord.Guild):
+    session = SESSIONS.get(guild.id)
+    if session is not None:
+        session.invalidate()
+
+@bot.event
+async def on_guild_role_create(role):
+    _forget_resolutions(role.guild)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    _forget_resolutions(after.guild)
+
+@bot.event
+async def on_guild_role_delete(role):
+    _forget_resolutions(role.guild)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    _forget_resolutions(channel.guild)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.perf_started = time.perf_counter()
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    started = getattr(ctx, 'perf_started', None)
+    if started is not None:
+        perf.observe('command', ctx.command.qualified_name, time.perf_counter() - started)
 
 @bot.event
 async def on_command_error(ctx, error):
+    perf.inc('command_errors', ctx.command.qualified_name if ctx.command else 'inconnue')
     if isinstance(error, SetupIncomplete):
         return await ctx.send(messages.TEXT["setup_incomplete"])
     if isinstance(error, WrongChannel):
-        if POMODORO_CHANNEL_ID is not None:
-            ch = bot.get_channel(POMODORO_CHANNEL_ID)
-            if ch:
-                return await ctx.send(f"❌ Utilisez {ch.mention}.")
+        ch = get_session(ctx.guild.id).channel
+        if ch:
+            return await ctx.send(f"❌ Utilisez {ch.mention}.")
         return await ctx.send("❌ Canal Pomodoro non configuré.")
     key = (
         "command_not_found"   if isinstance(error, commands.CommandNotFound) else
@@ -259,7 +515,9 @@ async def help_command(ctx):
             f"{PREFIX}leave — quitter la session en cours\n"
             f"{PREFIX}me — voir vos stats détaillées\n"
             f"{PREFIX}stats — statistiques du serveur\n"
-            f"{PREFIX}leaderboard — classements divers\n"
+            f"{PREFIX}leaderboard [catégorie] [page] — classements divers, paginés\n"
+            f"{PREFIX}rank [@membre] — rang et centile dans chaque classement\n"
+            f"{PREFIX}analytics [jours] — heatmap horaire, tendances et ratios\n"
             f"{PREFIX}status — voir l’état global du bot\n"
         ),
         inline=False
@@ -274,6 +532,10 @@ async def help_command(ctx):
             f"{PREFIX}defa — définir ou créer le rôle A\n"
             f"{PREFIX}defb — définir ou créer le rôle B\n"
             f"{PREFIX}clear_stats — réinitialiser toutes les stats\n"
+            f"{PREFIX}perf — latences et compteurs de performance\n"
+            f"{PREFIX}profile — profil cpu, sample ou mem pendant N secondes\n"
+            f"{PREFIX}rebuild_streaks — recalculer les streaks depuis l'historique\n"
+            f"{PREFIX}export — exporter l'historique (ndjson|csv [début] [fin])\n"
             f"{PREFIX}update — mise à jour & redémarrage du bot\n"
         ),
         inline=False
@@ -288,12 +550,13 @@ async def help_command(ctx):
 @check_channel()
 async def joinA(ctx):
     user = ctx.author
-    if user.id in PARTICIPANTS_A | PARTICIPANTS_B:
+    session = get_session(ctx.guild.id)
+    if session.mode_of(user.id):
         return await ctx.send(f"🚫 {user.mention}, déjà inscrit.")
-    
-    PARTICIPANTS_A.add(user.id)
+
+    session.participants['A'].add(user.id)
     await add_participant(user.id, ctx.guild.id, 'A')
-    await user.add_roles(await ensure_role(ctx.guild, POMO_ROLE_A))
+    ROLES.add(ctx.guild.id, user.id, await ensure_role(ctx.guild, 'A'))
     
     ph, rem = get_phase_and_remaining(datetime.now(timezone.utc), 'A')
     await ctx.send(f"✅ {user.mention} a rejoint A → **{ph}**, reste {format_duration(rem)}")
@@ -305,12 +568,13 @@ async def joinA(ctx):
 @check_channel()
 async def joinB(ctx):
     user = ctx.author
-    if user.id in PARTICIPANTS_A | PARTICIPANTS_B:
+    session = get_session(ctx.guild.id)
+    if session.mode_of(user.id):
         return await ctx.send(f"🚫 {user.mention}, déjà inscrit.")
-    
-    PARTICIPANTS_B.add(user.id)
+
+    session.participants['B'].add(user.id)
     await add_participant(user.id, ctx.guild.id, 'B')
-    await user.add_roles(await ensure_role(ctx.guild, POMO_ROLE_B))
+    ROLES.add(ctx.guild.id, user.id, await ensure_role(ctx.guild, 'B'))
     
     ph, rem = get_phase_and_remaining(datetime.now(timezone.utc), 'B')
     await ctx.send(f"✅ {user.mention} a rejoint B → **{ph}**, reste {format_duration(rem)}")
@@ -329,16 +593,13 @@ async def leave(ctx):
     elapsed = int(datetime.now(timezone.utc).timestamp() - join_ts)
 
     # Nettoyage en mémoire
-    if mode == 'A':
-        PARTICIPANTS_A.discard(user.id)
-    else:
-        PARTICIPANTS_B.discard(user.id)
+    session = get_session(ctx.guild.id)
+    session.participants.get(mode, set()).discard(user.id)
 
     # Retirer le rôle
-    role_name = POMO_ROLE_A if mode == 'A' else POMO_ROLE_B
-    role = discord.utils.get(ctx.guild.roles, name=role_name)
+    role = session.role(ctx.guild, mode if mode in MODES else 'B')
     if role:
-        await user.remove_roles(role)
+        ROLES.remove(ctx.guild.id, user.id, role)
 
     # Sauvegarde en DB
     await ajouter_temps(user.id, ctx.guild.id, elapsed, mode=mode, is_session_end=True)
@@ -354,36 +615,22 @@ async def me(ctx):
     user = ctx.author
     guild_id = ctx.guild.id
 
-    # Session en cours ?
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT join_ts, mode FROM participants WHERE guild_id=? AND user_id=?",
-            (guild_id, user.id)
-        )
-        rec = await cur.fetchone()
-    if rec:
-        join_ts, mode = rec
-        elapsed = int(datetime.now(timezone.utc).timestamp() - join_ts)
-        ph, _ = get_phase_and_remaining(datetime.now(timezone.utc), mode)
-        status = f"En mode **{mode}** ({ph}) depuis {format_duration(elapsed)}"
+    # Session, stats et streaks : un seul aller-retour ; rangs lus en mémoire,
+    # calculés sur les mêmes stats (tampon compris)
+    profile = await get_user_profile(guild_id, user.id)
+    ranks = await get_ranks(guild_id, user.id, stats=profile.stats)
+    if profile.join_ts is not None:
+        elapsed = int(datetime.now(timezone.utc).timestamp() - profile.join_ts)
+        ph, _ = get_phase_and_remaining(datetime.now(timezone.utc), profile.mode)
+        status = f"En mode **{profile.mode}** ({ph}) depuis {format_duration(elapsed)}"
     else:
         status = "Pas en session actuellement"
 
-    # Stats
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT total_seconds, work_seconds_A, break_seconds_A, work_seconds_B, break_seconds_B, session_count "
-            "FROM stats WHERE guild_id=? AND user_id=?",
-            (guild_id, user.id)
-        )
-        row = await cur.fetchone()
-    if row:
-        total_s, wA, bA, wB, bB, scount = row
-    else:
-        total_s = wA = bA = wB = bB = scount = 0
-
-    # Streaks
-    cs, bs = await get_streak(guild_id, user.id)
+    s = profile.stats
+    total_s, scount = s['total_seconds'], s['session_count']
+    wA, bA = s['work_seconds_A'], s['break_seconds_A']
+    wB, bB = s['work_seconds_B'], s['break_seconds_B']
+    cs, bs = profile.current_streak, profile.best_streak
 
     # Embed
     embed = discord.Embed(title=f"📋 Stats de {user.name}", color=messages.MsgColors.AQUA.value)
@@ -396,8 +643,25 @@ async def me(ctx):
     embed.add_field(name="Moyenne/session", value=format_duration(avg), inline=True)
     embed.add_field(name="🔥 Streak actuel", value=f"{cs} jours", inline=True)
     embed.add_field(name="🏅 Meilleur streak", value=f"{bs} jours", inline=True)
+    if any(ranks.values()):
+        embed.add_field(name="🏆 Rangs", value=format_ranks(ranks), inline=False)
     await ctx.send(embed=embed)
 
+# ─── Rank
+@bot.command(name='rank', help='Votre rang dans chaque classement : rank [@membre]')
+@check_maintenance()
+@check_setup()
+@check_channel()
+async def rank(ctx, member: discord.Member = None):
+    member = member or ctx.author
+    ranks = await get_ranks(ctx.guild.id, member.id)
+    e = discord.Embed(
+        title=f"🏆 Rangs de {member.display_name}",
+        description=format_ranks(ranks) if any(ranks.values()) else "Pas encore classé.",
+        color=messages.LEADERBOARD["color"]
+    )
+    await ctx.send(embed=e)
+
 # ─── Stats
 @bot.command(name='stats', help='Afficher les stats du serveur')
 @check_maintenance()
@@ -405,6 +669,13 @@ async def me(ctx):
 @check_channel()
 async def stats(ctx):
     guild_id = ctx.guild.id
+    # Les totaux 7 jours changent aussi à minuit : le jour fait partie de la clé
+    today = datetime.now(await get_guild_timezone(guild_id)).date()
+    generation = (get_generation(guild_id), today)
+    cached = EMBEDS.get(guild_id, 'stats', generation)
+    if cached is not None:
+        return await ctx.send(embed=cached)
+
     data    = await get_all_stats(guild_id)
     unique  = len(data)
     total_s = sum(r[2] for r in data)
@@ -422,65 +693,212 @@ async def stats(ctx):
     e.add_field(name="Moyenne/utilisateur", value=format_duration(avg), inline=False)
     e.add_field(name="📅 Totaux 7 jours", value=daily_str, inline=False)
     e.add_field(name="🗓 Sessions / semaine", value=weekly_str, inline=False)
+    EMBEDS.put(guild_id, 'stats', generation, e)
+    await ctx.send(embed=e)
+
+# ─── Analytics
+@bot.command(name='analytics', help="Habitudes d'étude du serveur : analytics [jours]")
+@check_maintenance()
+@check_setup()
+@check_channel()
+async def analytics_command(ctx, days: int = 90):
+    result = await analytics.guild_analytics(ctx.guild.id, days)
+    days = result['days']
+    e = discord.Embed(title=f"📈 Analyses — {days} derniers jours", color=messages.MsgColors.AQUA.value)
+    if result['rows'] == 0:
+        e.description = "aucune donnée"
+        return await ctx.send(embed=e)
+
+    heat = analytics.render_heatmap(result['heatmap'])
+    peak = result['peak']
+    peak_str = f"pic : {analytics.WEEKDAYS[peak[0]]} {peak[1]}h" if peak is not None else "pas de logs horaires"
+    e.add_field(name=f"🗓 Travail par heure (heure locale, {peak_str})", value=f"```\n{heat}\n```", inline=False)
+
+    trend = result['trend']
+    trend_str = f"{trend:+.0%} sur 7 jours" if trend is not None else "tendance indisponible"
+    e.add_field(
+        name=f"📉 Travail quotidien, moyenne glissante 7 j ({trend_str})",
+        value=f"`{analytics.sparkline(result['rolling'])}`\n"
+              f"moyenne {format_duration(int(result['daily'].mean()))}/jour",
+        inline=False
+    )
+
+    secs, counts = result['mode_seconds'], result['mode_sessions']
+    lines = []
+    for mode in MODES:
+        ratio = result['ratios'][mode]
+        lines.append(f"Mode {mode} : {format_duration(int(secs[mode]))} travail / "
+                     f"{format_duration(int(secs[f'{mode}_break']))} pause"
+                     + (f" (×{ratio:.1f})" if ratio is not None else "")
+                     + f", {counts[mode]} sessions")
+    e.add_field(name="⚖️ Travail / pause", value="\n".join(lines), inline=False)
+
+    dist = result['distribution']
+    if dist['users']:
+        e.add_field(
+            name=f"👥 Répartition ({dist['users']} actifs)",
+            value=f"médiane {format_duration(int(dist['p50']))}, "
+                  f"p25–p75 {format_duration(int(dist['p25']))}–{format_duration(int(dist['p75']))}, "
+                  f"p90 {format_duration(int(dist['p90']))}, max {format_duration(int(dist['max']))}\n"
+                  f"les 10 % les plus actifs font {dist['top10_share']:.0%} du travail",
+            inline=False
+        )
+    e.set_footer(text=f"{result['rows']} lignes ({result['raw_rows']} logs horaires), "
+                      f"calcul {result['elapsed'] * 1000:.0f} ms")
     await ctx.send(embed=e)
 
 # ─── Leaderboard
-@bot.command(name='leaderboard', help='Classements divers')
+@bot.command(name='leaderboard', help='Classements divers : leaderboard [catégorie] [page]')
 @check_maintenance()
 @check_setup()
 @check_channel()
-async def leaderboard(ctx):
-    guild_id = ctx.guild.id
-    rows = await get_all_stats(guild_id)
-
-    # Extraire les entrées utiles
-    entries_overall = [(uid, total) for (uid, _, total, *_ ) in rows]
-    entries_A = [(uid, wA) for (uid, _, _, wA, _, _, _, _) in rows]
-    entries_B = [(uid, wB) for (uid, _, _, _, _, wB, _, _) in rows]
-    entries_avg = [
-        (uid, (total/sc) if sc >= 10 else 0)
-        for (uid, _, total, _, _, _, _, sc) in rows
-    ]
-    entries_sessions = [(uid, sc) for (uid, _, _, _, _, _, _, sc) in rows]
+async def leaderboard(ctx, category: str = None, page: int = 1):
+    if category is not None:
+        metric = LEADERBOARD_CATEGORIES.get(category.lower())
+        if metric is None:
+            return await ctx.send(f"❌ Catégorie inconnue : `{category}` "
+                                  f"({', '.join(sorted(set(LEADERBOARD_CATEGORIES)))}).")
+        page = max(1, page) - 1
+        e, view = await render_leaderboard_page(ctx.guild, metric, page, offset=page * LEADERBOARD_PAGE_SIZE)
+        return await ctx.send(embed=e, view=view)
 
-    def top(entries, n=5):
-        return sorted(entries, key=lambda x: x[1], reverse=True)[:n]
+    guild_id = ctx.guild.id
+    today = datetime.now(await get_guild_timezone(guild_id)).date()
+    generation = (get_generation(guild_id), today)
+    cached = EMBEDS.get(guild_id, 'leaderboard', generation)
+    if cached is not None:
+        return await ctx.send(embed=cached)
 
     e = discord.Embed(title="🏆 Leaderboard", color=messages.LEADERBOARD["color"])
 
-    # Classements principaux
-    for title, entries in [
-        ("🌍 Top 10 - Global", top(entries_overall, 10)),
-        ("🥇 Top 5 - Mode A", top(entries_A)),
-        ("🥈 Top 5 - Mode B", top(entries_B)),
-        ("📊 Top 5 - Moyenne/session (10+)", top(entries_avg)),
-        ("🔄 Top 5 - Sessions", top(entries_sessions)),
-    ]:
+    # Classements principaux (TopK tenus à jour par database.get_top)
+    boards = [
+        ("🌍 Top 10 - Global", await get_top(guild_id, 'total', 10)),
+        ("🥇 Top 5 - Mode A", await get_top(guild_id, 'A', 5)),
+        ("🥈 Top 5 - Mode B", await get_top(guild_id, 'B', 5)),
+        ("📊 Top 5 - Moyenne/session (10+)", await get_top(guild_id, 'avg', 5)),
+        ("🔄 Top 5 - Sessions", await get_top(guild_id, 'sessions', 5)),
+    ]
+    streaks = await top_streaks(guild_id, limit=5)
+
+    # Tous les noms en une passe (caches, puis fetch_user concurrent)
+    names = await NAMES.resolve(ctx.guild, [uid for _, entries in boards for uid, _ in entries]
+                                           + [uid for uid, _, _ in streaks])
+
+    for title, entries in boards:
         if not entries or all(val == 0 for _, val in entries):
             value = "aucune donnée"
         else:
             lines = []
             for i, (uid, val) in enumerate(entries, start=1):
-                user = await bot.fetch_user(uid)
                 if isinstance(val, (int, float)) and val > 0:
                     label = format_duration(int(val))
                 else:
                     label = str(val)
-                lines.append(f"{i}. {user.name} — {label}")
+                lines.append(f"{i}. {names[uid]} — {label}")
             value = "\n".join(lines)
         e.add_field(name=title, value=value, inline=False)
 
     # Classement streaks
-    streaks = await top_streaks(guild_id, limit=5)
     if streaks:
         lines = []
         for i, (uid, cur, best) in enumerate(streaks, start=1):
-            user = await bot.fetch_user(uid)
-            lines.append(f"{i}. {user.name} — 🔥 {cur} jours (best {best})")
+            lines.append(f"{i}. {names[uid]} — 🔥 {cur} jours (best {best})")
         e.add_field(name="🔥 Top 5 Streaks", value="\n".join(lines), inline=False)
 
+    EMBEDS.put(guild_id, 'leaderboard', generation, e)
     await ctx.send(embed=e)
 
+# Pages : `*leaderboard <catégorie> [page]`, puis boutons ◀ ▶. Le curseur
+# (user_id, valeur) de la page voisine voyage dans le custom_id des boutons :
+# aucun état côté bot entre deux clics.
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_CATEGORIES = {
+    'global': 'total', 'total': 'total', 'a': 'A', 'b': 'B',
+    'moyenne': 'avg', 'avg': 'avg', 'sessions': 'sessions', 'streaks': 'streaks',
+}
+LEADERBOARD_TITLES = {
+    'total': "🌍 Global", 'A': "🥇 Mode A", 'B': "🥈 Mode B",
+    'avg': "📊 Moyenne/session (10+)", 'sessions': "🔄 Sessions", 'streaks': "🔥 Streaks",
+}
+
+def format_ranks(ranks: dict) -> str:
+    """« Global : #3 sur 120 (98ᵉ centile) », une ligne par métrique classée."""
+    return "\n".join(f"{LEADERBOARD_TITLES[metric]} : #{r.rank} sur {r.total} ({r.percentile:.0f}ᵉ centile)"
+                     for metric, r in ranks.items() if r is not None)
+
+def _leaderboard_label(metric: str, value) -> str:
+    if metric == 'streaks':
+        return f"🔥 {value} jours"
+    if metric == 'sessions':
+        return f"{value} sessions"
+    return format_duration(int(value))
+
+async def render_leaderboard_page(guild, metric: str, page: int, after=None, before=None, offset=0):
+    """(embed, vue) d'une page de classement ; `page` commence à 0."""
+    result = await get_leaderboard_page(guild.id, metric, LEADERBOARD_PAGE_SIZE, after, before, offset)
+    names = await NAMES.resolve(guild, [uid for uid, _ in result.rows])
+
+    first = page * LEADERBOARD_PAGE_SIZE + 1
+    lines = [f"{rank}. {names[uid]} — {_leaderboard_label(metric, val)}"
+             for rank, (uid, val) in enumerate(result.rows, start=first)]
+    e = discord.Embed(
+        title=f"🏆 Leaderboard — {LEADERBOARD_TITLES[metric]}",
+        description="\n".join(lines) if lines else "aucune donnée",
+        color=messages.LEADERBOARD["color"]
+    )
+    e.set_footer(text=f"Page {page + 1}")
+
+    # Vue jetable : arrêtée avant l'envoi, discord.py ne la garde pas en mémoire ;
+    # les clics arrivent dans on_interaction
+    view = discord.ui.View(timeout=None)
+    if result.rows:
+        (top_uid, top_val), (last_uid, last_val) = result.rows[0], result.rows[-1]
+        prev_id = f"lb:{metric}:{max(0, page - 1)}:p:{top_uid}:{top_val}"
+        next_id = f"lb:{metric}:{page + 1}:n:{last_uid}:{last_val}"
+        has_next = result.has_next
+    else:
+        # Page vide (saut au-delà de la fin, page vidée par un reset) : pas de
+        # curseur, ◀ repart de la première page et ▶ reste inactif
+        prev_id, next_id = f"lb:{metric}:0:f", f"lb:{metric}:-:n"
+        has_next = False
+    view.add_item(discord.ui.Button(label="◀", custom_id=prev_id, disabled=not result.has_prev))
+    view.add_item(discord.ui.Button(label="▶", custom_id=next_id, disabled=not has_next))
+    view.stop()
+    return e, view
+
+@bot.event
+async def on_interaction(interaction: discord.Interaction):
+    if interaction.type != discord.InteractionType.component or interaction.guild is None:
+        return
+    custom_id = (interaction.data or {}).get('custom_id', '')
+    if not custom_id.startswith('lb:'):
+        return
+    # Chaque clic reçoit une réponse, sinon Discord affiche « échec de l'interaction »
+    if get_maintenance(interaction.guild.id):
+        return await interaction.response.send_message(messages.TEXT["maintenance_active"], ephemeral=True)
+    try:
+        _, metric, page, direction, *cursor = custom_id.split(':')
+        page = int(page)
+        if direction == 'f':
+            kwargs = {}  # première page
+        else:
+            user_id, value = cursor
+            kwargs = {'after' if direction == 'n' else 'before': (int(user_id), int(value))}
+    except ValueError:
+        metric = None
+    if metric not in LEADERBOARD_METRICS:
+        return await interaction.response.send_message(
+            messages.TEXT["leaderboard_stale"].format(prefix=PREFIX), ephemeral=True)
+    with perf.timer('command', 'leaderboard_page'):
+        try:
+            e, view = await render_leaderboard_page(interaction.guild, metric, page, **kwargs)
+        except Exception as error:
+            logger.exception(f"Page de classement {custom_id}")
+            return await interaction.response.send_message(
+                messages.TEXT["unexpected_error"].format(error=str(error)), ephemeral=True)
+        await interaction.response.edit_message(embed=e, view=view)
+
 # ─── Status
 @bot.command(name='status', help='Afficher état global du bot')
 async def status(ctx):
@@ -496,34 +914,19 @@ async def status(ctx):
     phA, rA = get_phase_and_remaining(now_utc, 'A')
     phB, rB = get_phase_and_remaining(now_utc, 'B')
 
-    countA = len(PARTICIPANTS_A)
-    countB = len(PARTICIPANTS_B)
+    guild   = ctx.guild
+    session = get_session(guild.id)
+    countA  = len(session.participants['A'])
+    countB  = len(session.participants['B'])
 
-    chan = bot.get_channel(POMODORO_CHANNEL_ID)
+    chan = session.channel
     chan_field  = f"✅ {chan.mention}" if chan else "❌ non configuré"
 
-    guild       = ctx.guild
-    roleA       = discord.utils.get(guild.roles, name=POMO_ROLE_A)
-    roleB       = discord.utils.get(guild.roles, name=POMO_ROLE_B)
+    roleA       = session.role(guild, 'A')
+    roleB       = session.role(guild, 'B')
     roleA_field = f"✅ {roleA.mention}" if roleA else "❌ non configuré"
     roleB_field = f"✅ {roleB.mention}" if roleB else "❌ non configuré"
 
-    # Git SHA
-    proc = await asyncio.create_subprocess_shell(
-        "git rev-parse --short HEAD",
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.DEVNULL
-    )
-    out, _ = await proc.communicate()
-    sha = out.decode().strip() if out else "unknown"
-
-    # Version fichier
-    try:
-        with open("VERSION", encoding="utf-8") as f:
-            file_ver = f.read().strip()
-    except FileNotFoundError:
-        file_ver = "unknown"
-
     e = discord.Embed(title=messages.STATUS["title"], color=messages.STATUS["color"])
     e.add_field(name="Latence", value=f"{latency} ms", inline=True)
     e.add_field(name="Heure (Lausanne)", value=local_str, inline=True)
@@ -532,61 +935,134 @@ async def status(ctx):
     e.add_field(name="Canal Pomodoro", value=chan_field, inline=False)
     e.add_field(name="Rôle A", value=roleA_field, inline=False)
     e.add_field(name="Rôle B", value=roleB_field, inline=False)
-    e.add_field(name="Version (SHA)", value=sha, inline=True)
-    e.add_field(name="Version (fichier)", value=file_ver, inline=True)
+    e.add_field(name="Version (SHA)", value=GIT_SHA, inline=True)
+    e.add_field(name="Version (fichier)", value=FILE_VERSION, inline=True)
+    e.add_field(
+        name="Planificateur",
+        value=f"{pomodoro_scheduler.wakeups} réveils, dernier retard {pomodoro_scheduler.last_lateness*1000:.0f} ms",
+        inline=False
+    )
+    e.add_field(
+        name="Cache embeds",
+        value=f"{EMBEDS.hits} hits / {EMBEDS.misses} misses ({EMBEDS.hit_ratio:.0%})",
+        inline=False
+    )
+    e.add_field(
+        name="File des rôles",
+        value=f"{ROLES.pending()} en attente, {ROLES.applied} appliqués, "
+              f"{ROLES.coalesced} fusionnés, {ROLES.failed} échecs",
+        inline=False
+    )
+    p50, p99 = OUTBOX.latency()
+    e.add_field(
+        name="Envois",
+        value=f"{OUTBOX.depth()} en file, {OUTBOX.sent} envoyés, {OUTBOX.merged} fusionnés, "
+              f"{OUTBOX.dropped} périmés — latence p50 {p50:.2f}s / p99 {p99:.2f}s",
+        inline=False
+    )
     await ctx.send(embed=e)
 
 # ─── COMMANDES ADMIN ──────────────────────────────────────────────────────────
+# ─── Perf
+@bot.command(name="perf", help="Latences des commandes, requêtes DB, ticks et appels Discord")
+@is_admin()
+async def perf_command(ctx):
+    e = discord.Embed(
+        title="⏱️ Performances",
+        description=f"Fenêtre glissante des {perf.WINDOW} derniers appels par opération — "
+                    f"en ligne depuis {format_duration(int(perf.uptime()))}",
+        color=messages.MsgColors.AQUA.value
+    )
+    families = (
+        ("Commandes",     'command',      'command_errors'),
+        ("Base de données", 'db',         'db_errors'),
+        ("Ticks",         'tick',         'tick_errors'),
+        ("API Discord",   'discord_http', 'discord_http_errors'),
+    )
+    for title, family, errors in families:
+        rows = perf.snapshot(family)[:6]
+        if rows:
+            value = "\n".join(
+                f"`{label[:32]}` ×{count} — p50 {p50*1000:.1f} ms / p99 {p99*1000:.1f} ms"
+                for label, count, p50, p99 in rows
+            )
+        else:
+            value = "aucune mesure"
+        e.add_field(name=f"{title} ({perf.counter(errors)} erreurs)", value=value[:1024], inline=False)
+    await ctx.send(embed=e)
+
+# ─── Profile
+@bot.command(name="profile", help="Profiler le bot : profile <cpu|sample|mem> [secondes]")
+@is_admin()
+async def profile_command(ctx, kind: str = 'sample', seconds: int = 30):
+    runners = {'cpu': profiling.profile_cpu, 'sample': profiling.profile_sampling,
+               'mem': profiling.profile_memory}
+    if kind not in runners:
+        return await ctx.send(f"❌ Type inconnu : `{kind}` (cpu, sample ou mem).")
+    if profiling.busy():
+        return await ctx.send("⏳ Un profil est déjà en cours.")
+    seconds = max(1, min(seconds, profiling.MAX_SECONDS))
+    await ctx.send(f"🔬 Profil **{kind}** lancé pour {seconds}s...")
+
+    result = await runners[kind](seconds)
+    e = discord.Embed(
+        title=f"🔬 Profil {kind} ({seconds}s)",
+        description=f"Résultat complet : `{result['path']}`",
+        color=messages.MsgColors.AQUA.value
+    )
+
+    def block(lines):
+        return ("```\n" + "\n".join(lines)[:1000] + "\n```") if lines else "aucune donnée"
+
+    if kind == 'cpu':
+        e.add_field(name="Temps propre (top)", inline=False, value=block(
+            f"{tt*1000:8.1f} ms {calls:>6}× {name[:60]}" for name, calls, tt, _ in result['top']))
+        e.add_field(name="Ticks & classements (cumulé)", inline=False, value=block(
+            f"{ct*1000:8.1f} ms {calls:>6}× {name[:60]}" for name, calls, _, ct in result['focus']))
+    elif kind == 'sample':
+        e.description += f" — {result['samples']} échantillons"
+        e.add_field(name="Temps propre (top)", inline=False, value=block(
+            f"{part:6.1%} {name[:70]}" for name, part in result['self']))
+        e.add_field(name="Ticks & classements (inclusif)", inline=False, value=block(
+            f"{part:6.1%} {name[:70]}" for name, part in result['focus']))
+    else:
+        e.description += f" — croissance nette {result['growth'] / 1024:+.1f} Kio"
+        e.add_field(name="Sites d'allocation", inline=False, value=block(
+            f"{size / 1024:+9.1f} Kio {count:+7}× {site[:60]}" for site, size, count in result['top']))
+    await ctx.send(embed=e)
+
 # ─── Maintenance
 @bot.command(name="maintenance", help="Activer ou désactiver le mode maintenance")
 @is_admin()
 async def maintenance(ctx):
     guild_id = ctx.guild.id
-    enabled = not await get_maintenance(guild_id)
+    enabled = not get_maintenance(guild_id)
     await set_maintenance(guild_id, enabled)
 
     if enabled:
         # Sauvegarder et retirer les participants
         now_ts = datetime.now(timezone.utc).timestamp()
-        async with aiosqlite.connect(DB_PATH) as db:
-            cur = await db.execute(
-                "SELECT user_id, join_ts, mode FROM participants WHERE guild_id=?",
-                (guild_id,)
-            )
-            rows = await cur.fetchall()
-
-        for user_id, join_ts, mode in rows:
-            elapsed = int(now_ts - join_ts)
-            await ajouter_temps(user_id, guild_id, elapsed, mode=mode, is_session_end=True)
-
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute("DELETE FROM participants WHERE guild_id=?", (guild_id,))
-            await db.commit()
+        rows = await remove_all_participants(guild_id)
+        await ajouter_temps_many(guild_id, [
+            (user_id, int(now_ts - join_ts), mode, True) for user_id, join_ts, mode in rows
+        ])
 
         # Retirer les rôles Pomodoro
-        roleA = discord.utils.get(ctx.guild.roles, name=POMO_ROLE_A)
-        roleB = discord.utils.get(ctx.guild.roles, name=POMO_ROLE_B)
-        for member in ctx.guild.members:
-            if roleA in member.roles:
-                await member.remove_roles(roleA)
-            if roleB in member.roles:
-                await member.remove_roles(roleB)
-
-        PARTICIPANTS_A.clear()
-        PARTICIPANTS_B.clear()
+        session = get_session(guild_id)
+        for mode in MODES:
+            role = session.role(ctx.guild, mode)
+            if role:
+                ROLES.clear_role(role)
 
-        if pomodoro_loop.is_running():
-            pomodoro_loop.stop()
+        for users in session.participants.values():
+            users.clear()
 
         await ctx.send("🚧 Mode maintenance activé. Toutes les sessions ont été arrêtées.")
     else:
-        if not pomodoro_loop.is_running():
-            pomodoro_loop.start()
-
         # Message de retour
-        chan = bot.get_channel(POMODORO_CHANNEL_ID)
+        chan = get_session(guild_id).channel
         if chan:
-            await chan.send("✅ Maintenance terminée, le bot est de retour ! 🎉")
+            OUTBOX.post(chan, "✅ Maintenance terminée, le bot est de retour ! 🎉")
 
         await ctx.send("✅ Maintenance terminée.")
 
@@ -594,14 +1070,9 @@ async def maintenance(ctx):
 @bot.command(name="defs", help="Définir le salon Pomodoro")
 @is_admin()
 async def defs(ctx, channel: discord.TextChannel = None):
-    global POMODORO_CHANNEL_ID
     channel = channel or ctx.channel  # par défaut : le salon actuel
-    POMODORO_CHANNEL_ID = channel.id
-
-    # Mettre à jour le fichier settings.ini
-    config.set("CURRENT_SETTINGS", "channel_id", str(channel.id))
-    with open("settings.ini", "w", encoding="utf-8") as f:
-        config.write(f)
+    await set_setting(ctx.guild.id, 'channel_id', channel.id)
+    get_session(ctx.guild.id).invalidate()
 
     e = discord.Embed(
         title="⚙️ Configuration mise à jour",
@@ -614,7 +1085,6 @@ async def defs(ctx, channel: discord.TextChannel = None):
 @bot.command(name="defa", help="Définir ou créer le rôle Pomodoro A")
 @is_admin()
 async def defa(ctx, *, role_name: str = None):
-    global POMO_ROLE_A
     guild = ctx.guild
 
     if role_name:
@@ -622,16 +1092,10 @@ async def defa(ctx, *, role_name: str = None):
         if role is None:
             role = await guild.create_role(name=role_name, colour=discord.Colour(0x206694))
     else:
-        role = discord.utils.get(guild.roles, name=POMO_ROLE_A)
-        if role is None:
-            role = await guild.create_role(name=POMO_ROLE_A, colour=discord.Colour(0x206694))
-
-    POMO_ROLE_A = role.name
+        role = await ensure_role(guild, 'A')
 
-    # Mise à jour du settings.ini
-    config.set("CURRENT_SETTINGS", "pomodoro_role_A", POMO_ROLE_A)
-    with open("settings.ini", "w", encoding="utf-8") as f:
-        config.write(f)
+    await set_role_setting(guild.id, 'A', role.id, role.name)
+    get_session(guild.id).invalidate()
 
     e = discord.Embed(
         title="⚙️ Configuration mise à jour",
@@ -645,7 +1109,6 @@ async def defa(ctx, *, role_name: str = None):
 @bot.command(name="defb", help="Définir ou créer le rôle Pomodoro B")
 @is_admin()
 async def defb(ctx, *, role_name: str = None):
-    global POMO_ROLE_B
     guild = ctx.guild
 
     if role_name:
@@ -653,16 +1116,10 @@ async def defb(ctx, *, role_name: str = None):
         if role is None:
             role = await guild.create_role(name=role_name, colour=discord.Colour(0x206694))
     else:
-        role = discord.utils.get(guild.roles, name=POMO_ROLE_B)
-        if role is None:
-            role = await guild.create_role(name=POMO_ROLE_B, colour=discord.Colour(0x206694))
+        role = await ensure_role(guild, 'B')
 
-    POMO_ROLE_B = role.name
-
-    # Mise à jour du settings.ini
-    config.set("CURRENT_SETTINGS", "pomodoro_role_B", POMO_ROLE_B)
-    with open("settings.ini", "w", encoding="utf-8") as f:
-        config.write(f)
+    await set_role_setting(guild.id, 'B', role.id, role.name)
+    get_session(guild.id).invalidate()
 
     e = discord.Embed(
         title="⚙️ Configuration mise à jour",
@@ -676,12 +1133,9 @@ async def defb(ctx, *, role_name: str = None):
 @is_admin()
 async def clear_stats(ctx):
     guild_id = ctx.guild.id
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Reset des stats
-        await db.execute("DELETE FROM stats WHERE guild_id=?", (guild_id,))
-        await db.execute("DELETE FROM session_logs WHERE guild_id=?", (guild_id,))
-        await db.execute("DELETE FROM streaks WHERE guild_id=?", (guild_id,))
-        await db.commit()
+    await clear_guild_stats(guild_id)
+    # Embeds désormais périmés : inutile de les garder en mémoire
+    EMBEDS.invalidate(guild_id)
 
     e = discord.Embed(
         title="🗑 Réinitialisation effectuée",
@@ -690,51 +1144,99 @@ async def clear_stats(ctx):
     )
     await ctx.send(embed=e)
 
+# ─── Rebuild Streaks 
+@bot.command(name="rebuild_streaks", help="Recalculer les streaks depuis l'historique")
+@is_admin()
+async def rebuild_streaks_cmd(ctx):
+    count = await rebuild_streaks(ctx.guild.id)
+
+    e = discord.Embed(
+        title="🔥 Streaks recalculés",
+        description=f"Streaks de {count} utilisateur(s) reconstruits depuis l'historique des sessions.",
+        color=discord.Color.green()
+    )
+    await ctx.send(embed=e)
+
+# ─── Export
+@bot.command(name="export", help="Exporter l'historique : export [ndjson|csv] [YYYY-MM-DD début] [YYYY-MM-DD fin]")
+@is_admin()
+async def export_command(ctx, fmt: str = 'ndjson', since: str = None, until: str = None):
+    if fmt not in export.FORMATS:
+        return await ctx.send(f"❌ Format inconnu : `{fmt}` (ndjson ou csv).")
+    try:
+        start = export.parse_day(since) if since else None
+        end = export.parse_day(until) if until else None
+    except ValueError:
+        return await ctx.send("❌ Dates attendues au format YYYY-MM-DD.")
+    if export.busy():
+        return await ctx.send("⏳ Un export est déjà en cours.")
+    await ctx.send("📦 Export en cours...")
+
+    results = await export.export_guild(ctx.guild.id, fmt, start, end)
+    sizes = [path.stat().st_size for _, path, _ in results]
+    e = discord.Embed(
+        title=f"📦 Export {fmt}",
+        description="\n".join(f"`{path.name}` — {rows} ligne(s), {size / 1024:.1f} Kio"
+                              for (_, path, rows), size in zip(results, sizes)),
+        color=messages.MsgColors.AQUA.value
+    )
+    # Pièces jointes si la limite du serveur le permet (puis supprimées du disque),
+    # sinon fichiers laissés dans DATA_DIR
+    if sum(sizes) <= ctx.guild.filesize_limit and len(results) <= 10:
+        files = [discord.File(path) for _, path, _ in results]
+        try:
+            await ctx.send(embed=e, files=files)
+        finally:
+            for f in files:
+                f.close()
+            for _, path, _ in results:
+                path.unlink(missing_ok=True)
+    else:
+        e.set_footer(text=f"Trop volumineux pour Discord : fichiers dans {export.EXPORT_DIR}")
+        await ctx.send(embed=e)
+
 # ─── Update 
 @bot.command(name="update", help="Mettre à jour et redémarrer le bot")
 @is_admin()
 async def update(ctx):
     guild_id = ctx.guild.id
-    now_ts = datetime.now(timezone.utc).timestamp()
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT user_id, join_ts, mode FROM participants WHERE guild_id=?",
-            (guild_id,)
-        )
-        rows = await cur.fetchall()
-
-    for user_id, join_ts, mode in rows:
-        elapsed = int(now_ts - join_ts)
-        await ajouter_temps(user_id, guild_id, elapsed, mode=mode, is_session_end=True)
-
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM participants WHERE guild_id=?", (guild_id,))
-        await db.commit()
-
-    roleA = discord.utils.get(ctx.guild.roles, name=POMO_ROLE_A)
-    roleB = discord.utils.get(ctx.guild.roles, name=POMO_ROLE_B)
-    for member in ctx.guild.members:
-        if roleA in member.roles:
-            await member.remove_roles(roleA)
-        if roleB in member.roles:
-            await member.remove_roles(roleB)
-
-    PARTICIPANTS_A.clear()
-    PARTICIPANTS_B.clear()
-
+    # Les sessions en cours sont conservées : warm_restart les recharge au démarrage
     await ctx.send("♻️ Mise à jour lancée, le bot va redémarrer...")
 
     # On crée un flag pour que on_ready poste un message de retour
     with open(".rebooting", "w") as f:
         f.write(str(guild_id))
 
+    await ROLES.join()
+    await shutdown_db()
     os.system("deploy-lre")
     sys.exit(0)
 
 # Lancement du bot -----------------------------------------------------------------------------------------
+async def shutdown_db():
+    pomodoro_scheduler.stop()
+    await set_heartbeat(time.time())
+    await close_db()
+
+async def main():
+    # Les connexions DB vivent aussi longtemps que le bot
+    async with bot:
+        await init_db()
+        load_schedule()
+        metrics = await perf.start_metrics_server(METRICS_PORT) if METRICS_PORT else None
+        try:
+            await bot.start(TOKEN)
+        finally:
+            if metrics is not None:
+                await metrics.cleanup()
+            await shutdown_db()
+
 if __name__ == '__main__':
     if TOKEN is None:
         print("❌ DISCORD_TOKEN environment variable is missing!")
         exit(1)
-    bot.run(TOKEN)
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -1,19 +1,240 @@
 # database.py
 
 import aiosqlite
+import asyncio
+import configparser
+import json
+import logging
 import os
-from datetime import datetime, timezone, timedelta
+import sys
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone, timedelta
 from pathlib import Path
+from typing import NamedTuple, Optional
 from zoneinfo import ZoneInfo
 
+import perf
+import ranking
+
 # ─── RÉPERTOIRE & CHEMIN DB ────────────────────────────────────────────────────
 DATA_DIR = os.getenv('POMOBOT_DATA_DIR', 'data')
 Path(DATA_DIR).mkdir(parents=True, exist_ok=True)
 DB_PATH = Path(DATA_DIR) / 'pomobot.db'
+READER_POOL_SIZE = int(os.getenv('POMOBOT_DB_READERS', '3'))
+JOURNAL_PATH = Path(DATA_DIR) / 'accounting.journal'
+FLUSH_INTERVAL = float(os.getenv('POMOBOT_FLUSH_INTERVAL', '5'))
+FLUSH_THRESHOLD = int(os.getenv('POMOBOT_FLUSH_THRESHOLD', '500'))
+
+logger = logging.getLogger('pomodoro_bot.database')
+
+# ─── PROFIL DE STOCKAGE ────────────────────────────────────────────────────────
+# Section [STORAGE] de settings.ini, surchargée par POMOBOT_SQLITE_<CLÉ>
+_storage_config = configparser.ConfigParser()
+_storage_config.read('settings.ini')
+
+def _storage_option(key: str, default: str) -> str:
+    value = os.getenv(f'POMOBOT_SQLITE_{key.upper()}')
+    if value is None:
+        value = _storage_config.get('STORAGE', key, fallback=default)
+    value = value.strip()
+    if not value.lstrip('-').isalnum():
+        raise ValueError(f"Valeur invalide pour {key} : {value!r}")
+    return value
+
+STORAGE_PROFILE = {
+    'journal_mode':       _storage_option('journal_mode', 'WAL'),
+    'synchronous':        _storage_option('synchronous', 'NORMAL'),
+    'cache_size':         _storage_option('cache_size', '-16000'),      # négatif = Kio
+    'mmap_size':          _storage_option('mmap_size', '67108864'),
+    'temp_store':         _storage_option('temp_store', 'MEMORY'),
+    'busy_timeout':       _storage_option('busy_timeout', '5000'),      # ms
+    # Pas de checkpoint automatique : c'est CheckpointScheduler qui s'en charge
+    'wal_autocheckpoint': _storage_option('wal_autocheckpoint', '0'),
+}
+CHECKPOINT_INTERVAL = int(_storage_option('checkpoint_interval', '5'))  # minutes
+# Minutes des bascules de phase, à éviter pour les checkpoints
+CHECKPOINT_AVOID_MINUTES = (0, 25, 30, 50, 55)
+
+# ─── RÉTENTION ─────────────────────────────────────────────────────────────────
+# Section [RETENTION] de settings.ini, surchargée par POMOBOT_RETENTION_<CLÉ>.
+# Désactivée par défaut : les logs agrégés perdent leur heure (voir settings.ini)
+def _retention_option(key: str, default: str) -> str:
+    return os.getenv(f'POMOBOT_RETENTION_{key.upper()}') or \
+        _storage_config.get('RETENTION', key, fallback=default)
+
+RETENTION_DAYS = int(_retention_option('days', '0'))  # 0 = logs bruts gardés indéfiniment
+RETENTION_INTERVAL = float(_retention_option('interval', '24'))  # heures entre deux passes
+
+# ─── FUSEAU HORAIRE & TRANCHES DE TEMPS ────────────────────────────────────────
+# Fuseau par défaut ; un serveur peut le changer via le setting 'timezone'
+TIMEZONE = ZoneInfo("Europe/Zurich")
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_guild_timezones = {}
+
+def day_bucket(ts: float, tz: ZoneInfo) -> int:
+    """Numéro du jour local (jours depuis 1970-01-01) d'un timestamp UTC."""
+    return datetime.fromtimestamp(ts, tz).date().toordinal() - _EPOCH_ORDINAL
+
+def week_bucket(day: int) -> int:
+    """Numéro de semaine (lundi-dimanche) d'un day_bucket."""
+    # Le 1970-01-01 était un jeudi : +3 cale le début de semaine sur le lundi
+    return (day + 3) // 7
+
+async def get_guild_timezone(guild_id: int) -> ZoneInfo:
+    tz = _guild_timezones.get(guild_id)
+    if tz is None:
+        name = _settings.get(guild_id, 'timezone')
+        tz = ZoneInfo(name) if name else TIMEZONE
+        _guild_timezones[guild_id] = tz
+    return tz
+
+async def _today(guild_id: int) -> int:
+    """day_bucket du jour en cours pour un serveur."""
+    return day_bucket(datetime.now(timezone.utc).timestamp(), await get_guild_timezone(guild_id))
+
+# ─── CONNEXIONS ────────────────────────────────────────────────────────────────
+class ConnectionManager:
+    """Une connexion d'écriture dédiée + un petit pool de connexions de lecture.
+
+    Les connexions sont ouvertes une seule fois (dans `init_db`) et réutilisées
+    par toutes les fonctions du module, au lieu d'un `aiosqlite.connect` par appel.
+    """
+
+    def __init__(self, path, readers: int = READER_POOL_SIZE):
+        self.path = path
+        self.readers = max(1, readers)
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._pool = None
+        self._reader_conns = []
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        for pragma, value in STORAGE_PROFILE.items():
+            await conn.execute(f"PRAGMA {pragma}={value}")
+        return conn
+
+    async def open(self):
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            self._writer = await self._connect()
+            self._pool = asyncio.Queue()
+            for _ in range(self.readers):
+                conn = await self._connect()
+                self._reader_conns.append(conn)
+                self._pool.put_nowait(conn)
+
+    async def close(self):
+        async with self._open_lock:
+            if self._writer is None:
+                return
+            # Attendre la fin de la transaction d'écriture en cours
+            async with self._write_lock:
+                await self._writer.close()
+                self._writer = None
+            for conn in self._reader_conns:
+                await conn.close()
+            self._reader_conns.clear()
+            self._pool = None
+
+    @asynccontextmanager
+    async def writer(self):
+        """Transaction sur la connexion d'écriture (commit ou rollback en sortie)."""
+        if self._writer is None:
+            await self.open()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    @asynccontextmanager
+    async def reader(self):
+        """Emprunte une connexion de lecture au pool."""
+        if self._writer is None:
+            await self.open()
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put_nowait(conn)
+
+_db = ConnectionManager(DB_PATH)
+
+class CheckpointScheduler:
+    """Checkpoints WAL passifs, planifiés hors des minutes de bascule.
+
+    Une bascule de phase déclenche une rafale d'écritures : un checkpoint qui
+    tomberait au même moment retarderait les annonces. On vise donc la 30e
+    seconde d'une minute éloignée d'au moins `margin` minutes de chaque bascule.
+    """
+
+    def __init__(self, interval: int, avoid_minutes, margin: int = 1):
+        self.interval = max(1, interval)
+        self.avoid_minutes = tuple(avoid_minutes)
+        self.margin = margin
+        self._task = None
+
+    def _is_quiet(self, minute: int) -> bool:
+        return all(min((minute - b) % 60, (b - minute) % 60) > self.margin
+                   for b in self.avoid_minutes)
+
+    def next_run(self, now: datetime) -> datetime:
+        candidate = now.replace(second=30, microsecond=0) + timedelta(minutes=self.interval)
+        for _ in range(60):
+            if self._is_quiet(candidate.minute):
+                break
+            candidate += timedelta(minutes=1)
+        return candidate
+
+    async def checkpoint(self):
+        async with _db.writer() as db:
+            cur = await db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            busy, wal_pages, moved = await cur.fetchone()
+        logger.debug(f"Checkpoint WAL : {moved}/{wal_pages} pages (busy={busy})")
+
+    async def _run(self):
+        while True:
+            now = datetime.now(timezone.utc)
+            await asyncio.sleep((self.next_run(now) - now).total_seconds())
+            try:
+                await self.checkpoint()
+            except Exception:
+                logger.exception("Échec du checkpoint WAL")
+
+    def start(self):
+        if self._task is None and STORAGE_PROFILE['journal_mode'].upper() == 'WAL':
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+_checkpoints = CheckpointScheduler(CHECKPOINT_INTERVAL, CHECKPOINT_AVOID_MINUTES)
+
+def set_checkpoint_avoid_minutes(minutes):
+    """Minutes de bascule à éviter, fournies par le planificateur du bot."""
+    _checkpoints.avoid_minutes = tuple(sorted(minutes))
 
 # ─── INITIALISATION & MIGRATION ────────────────────────────────────────────────
+async def load_settings():
+    """Charge les réglages en mémoire sans démarrer tampon ni tâches (outils hors bot)."""
+    await _settings.load()
+
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
+    await _db.open()
+    async with _db.writer() as db:
         # Table participants (qui est actuellement en session)
         await db.execute("""
         CREATE TABLE IF NOT EXISTS participants (
@@ -37,6 +258,17 @@ async def init_db():
         )
         """)
 
+        # last_day : day_bucket de la dernière session (last_session_date en clair)
+        cursor = await db.execute("PRAGMA table_info(streaks)")
+        if 'last_day' not in [r[1] for r in await cursor.fetchall()]:
+            await db.execute("ALTER TABLE streaks ADD COLUMN last_day INTEGER")
+
+        # Top-N des streaks : parcours dans l'ordre du classement, last_day filtré dans l'index
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_streaks_top
+            ON streaks(guild_id, current_streak, user_id, last_day, best_streak)
+        """)
+
         # Table stats (données de révision + colonnes étendues)
         await db.execute("""
         CREATE TABLE IF NOT EXISTS stats (
@@ -62,16 +294,65 @@ async def init_db():
             if col not in cols:
                 await db.execute(f"ALTER TABLE stats ADD COLUMN {col} {definition}")
 
+        # Index de classement (voir ranking.METRICS)
+        for col in ('total_seconds', 'work_seconds_A', 'work_seconds_B', 'session_count'):
+            await db.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_stats_{col}
+                ON stats(guild_id, {col}, user_id)
+            """)
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stats_avg
+            ON stats(guild_id, (total_seconds / session_count), user_id)
+            WHERE session_count >= 10
+        """)
+
         # Table logs de sessions (historique détaillé)
+        # day_bucket/week_bucket : jour et semaine locaux du serveur, fixés à l'insertion
         await db.execute("""
         CREATE TABLE IF NOT EXISTS session_logs (
+            guild_id    INTEGER,
+            user_id     INTEGER,
+            timestamp   REAL,
+            mode        TEXT,
+            duration    INTEGER,
+            day_bucket  INTEGER,
+            week_bucket INTEGER,
+            PRIMARY KEY (guild_id, user_id, timestamp, mode)
+        )
+        """)
+
+        cursor = await db.execute("PRAGMA table_info(session_logs)")
+        cols = [r[1] for r in await cursor.fetchall()]
+        for col in ('day_bucket', 'week_bucket'):
+            if col not in cols:
+                await db.execute(f"ALTER TABLE session_logs ADD COLUMN {col} INTEGER")
+
+        # Index couvrants pour les requêtes par période
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_logs_guild_ts
+            ON session_logs(guild_id, timestamp)
+        """)
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_logs_guild_day
+            ON session_logs(guild_id, day_bucket, duration)
+        """)
+        await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_logs_guild_week
+            ON session_logs(guild_id, week_bucket)
+        """)
+
+        # Agrégats quotidiens des logs sortis de la fenêtre de rétention (voir RetentionJob)
+        # sessions = nombre de lignes session_logs agrégées
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS daily_user_totals (
             guild_id   INTEGER,
+            day_bucket INTEGER,
             user_id    INTEGER,
-            timestamp  REAL,
             mode       TEXT,
-            duration   INTEGER,
-            PRIMARY KEY (guild_id, user_id, timestamp, mode)
-        )
+            seconds    INTEGER DEFAULT 0,
+            sessions   INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, day_bucket, user_id, mode)
+        ) WITHOUT ROWID
         """)
 
         # Table settings (configuration flexible par serveur)
@@ -84,82 +365,538 @@ async def init_db():
         )
         """)
 
+        # Dernier lot du journal appliqué (voir WriteBuffer)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS journal_state (
+            id       INTEGER PRIMARY KEY CHECK (id = 1),
+            last_seq INTEGER
+        )
+        """)
+
+        # Table user_names (noms Discord connus, pour les classements)
+        await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_names (
+            user_id    INTEGER PRIMARY KEY,
+            name       TEXT,
+            updated_at REAL
+        )
+        """)
 
-        await db.commit()
+    await _settings.load()
+    await _migrate()
+    await _enable_incremental_vacuum()
+    await _buffer.start()
+    _checkpoints.start()
+    _retention.start()
+
+async def _migrate():
+    """Migrations de données ponctuelles, suivies par PRAGMA user_version."""
+    async with _db.writer() as db:
+        cur = await db.execute("PRAGMA user_version")
+        version = (await cur.fetchone())[0]
+        if version < 1:
+            await _backfill_buckets(db)
+            await db.execute("PRAGMA user_version=1")
+        if version < 2:
+            # 2440587.5 = julianday('1970-01-01')
+            await db.execute("""
+                UPDATE streaks SET last_day = CAST(julianday(last_session_date) - 2440587.5 AS INTEGER)
+                WHERE last_day IS NULL AND last_session_date IS NOT NULL
+            """)
+            await db.execute("PRAGMA user_version=2")
+
+async def _enable_incremental_vacuum():
+    """Passe la base en auto_vacuum=INCREMENTAL (un VACUUM complet, une seule fois)."""
+    async with _db.writer() as db:
+        cur = await db.execute("PRAGMA auto_vacuum")
+        if (await cur.fetchone())[0] == 2:
+            return
+        logger.info("Activation de auto_vacuum=INCREMENTAL (VACUUM ponctuel)...")
+        await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        await db.execute("VACUUM")
+
+async def _backfill_buckets(db, chunk: int = 5000):
+    """Calcule day_bucket/week_bucket des logs antérieurs aux colonnes."""
+    cur = await db.execute(
+        "SELECT DISTINCT guild_id FROM session_logs WHERE day_bucket IS NULL AND timestamp IS NOT NULL"
+    )
+    for (guild_id,) in await cur.fetchall():
+        cur = await db.execute("SELECT value FROM settings WHERE guild_id=? AND key='timezone'",
+                               (guild_id,))
+        row = await cur.fetchone()
+        tz = ZoneInfo(row[0]) if row else TIMEZONE
+        while True:
+            cur = await db.execute("""
+                SELECT rowid, timestamp FROM session_logs
+                WHERE guild_id=? AND day_bucket IS NULL AND timestamp IS NOT NULL
+                LIMIT ?
+            """, (guild_id, chunk))
+            rows = await cur.fetchall()
+            if not rows:
+                break
+            updates = []
+            for rowid, ts in rows:
+                day = day_bucket(ts, tz)
+                updates.append((day, week_bucket(day), rowid))
+            await db.executemany(
+                "UPDATE session_logs SET day_bucket=?, week_bucket=? WHERE rowid=?", updates
+            )
+
+async def close_db():
+    """Vide le tampon d'écriture puis ferme les connexions (arrêt du bot)."""
+    _checkpoints.stop()
+    _retention.stop()
+    await _buffer.stop()
+    await _db.close()
 
 # ─── AJOUT / MISE À JOUR TEMPS ─────────────────────────────────────────────────
+# Colonne de stats créditée selon le mode
+MODE_COLUMNS = {
+    'A':       'work_seconds_A',
+    'A_break': 'break_seconds_A',
+    'B':       'work_seconds_B',
+    'B_break': 'break_seconds_B',
+}
+
+_UPSERT_STATS = """
+    INSERT INTO stats(guild_id, user_id, seconds, total_seconds,
+                      work_seconds_A, break_seconds_A,
+                      work_seconds_B, break_seconds_B, session_count)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        seconds         = seconds         + excluded.seconds,
+        total_seconds   = total_seconds   + excluded.total_seconds,
+        work_seconds_A  = work_seconds_A  + excluded.work_seconds_A,
+        break_seconds_A = break_seconds_A + excluded.break_seconds_A,
+        work_seconds_B  = work_seconds_B  + excluded.work_seconds_B,
+        break_seconds_B = break_seconds_B + excluded.break_seconds_B,
+        session_count   = session_count   + excluded.session_count
+"""
+
+_INSERT_LOG = """
+    INSERT OR IGNORE INTO session_logs
+    (guild_id, user_id, timestamp, mode, duration, day_bucket, week_bucket)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Streak d'un utilisateur après une session le jour :day (day_bucket).
+# Dans un UPSERT, toutes les expressions lisent l'ancienne ligne.
+_STREAK_AFTER = """
+    CASE WHEN streaks.last_day >= excluded.last_day     THEN streaks.current_streak
+         WHEN streaks.last_day  = excluded.last_day - 1 THEN streaks.current_streak + 1
+         ELSE 1 END
+"""
+_UPSERT_STREAK = f"""
+    INSERT INTO streaks(guild_id, user_id, current_streak, best_streak, last_day, last_session_date)
+    VALUES (:guild, :user, 1, 1, :day, date(:day * 86400, 'unixepoch'))
+    ON CONFLICT(guild_id, user_id) DO UPDATE SET
+        current_streak    = {_STREAK_AFTER},
+        best_streak       = MAX(streaks.best_streak, {_STREAK_AFTER}),
+        last_day          = MAX(COALESCE(streaks.last_day, excluded.last_day), excluded.last_day),
+        last_session_date = date(MAX(COALESCE(streaks.last_day, excluded.last_day), excluded.last_day)
+                                 * 86400, 'unixepoch')
+"""
+
+# Streak en cours vu depuis le jour :today : il s'éteint sans session hier ni aujourd'hui
+_LIVE_STREAK = "CASE WHEN {t}.last_day >= :today - 1 THEN {t}.current_streak ELSE 0 END"
+
+_SAVE_JOURNAL_SEQ = """
+    INSERT INTO journal_state(id, last_seq) VALUES (1, ?)
+    ON CONFLICT(id) DO UPDATE SET last_seq=excluded.last_seq
+"""
+
+class WriteBuffer:
+    """Tampon write-behind pour les crédits de temps.
+
+    Les incréments sont coalescés par (guild_id, user_id, mode) et appliqués à
+    `stats`/`session_logs` toutes les FLUSH_INTERVAL secondes, ou dès que
+    FLUSH_THRESHOLD entrées sont en attente. Chaque lot est d'abord ajouté au
+    journal local (une ligne JSON numérotée) : au démarrage, les lots dont le
+    numéro dépasse `journal_state.last_seq` sont rejoués, donc un crash entre
+    deux flush ne perd rien et ne compte rien deux fois.
+    """
+
+    def __init__(self, journal_path: Path, interval: float, threshold: int):
+        self.journal_path = journal_path
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = {}    # (guild_id, user_id, mode) -> [seconds, sessions]
+        self._logs = []       # lignes session_logs en attente
+        self._streaks = set() # (guild_id, user_id, day_bucket) des fins de session
+        self._recent = deque(maxlen=4)  # (seq, deltas) des derniers flush, pour les lectures
+        self._seq = 0         # numéro du dernier lot journalisé
+        self._lock = asyncio.Lock()        # protège l'état en mémoire + le journal
+        self._flush_lock = asyncio.Lock()  # un seul flush à la fois
+        self._task = None
+        self._background = set()
+
+    # ── Journal ──
+    def _segments(self) -> list:
+        """Journal actif + segments en cours de flush, dans l'ordre."""
+        rotated = sorted(self.journal_path.parent.glob(self.journal_path.name + '.*'),
+                         key=lambda p: int(p.suffix[1:]))
+        return rotated + ([self.journal_path] if self.journal_path.exists() else [])
+
+    def _append(self, line: str):
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _journal(self, record: dict):
+        """Journalise puis applique un lot (appelé sous self._lock)."""
+        self._seq += 1
+        record['seq'] = self._seq
+        await asyncio.to_thread(self._append, json.dumps(record, separators=(',', ':')))
+        self._apply(record)
+
+    def _apply(self, record: dict):
+        guild_id = record['guild_id']
+        if record.get('discard'):
+            self._pending = {k: v for k, v in self._pending.items() if k[0] != guild_id}
+            self._logs = [r for r in self._logs if r[0] != guild_id]
+            self._streaks = {s for s in self._streaks if s[0] != guild_id}
+            return
+        ts, day = record['ts'], record['day']
+        for user_id, seconds, mode, is_session_end in record['entries']:
+            acc = self._pending.setdefault((guild_id, user_id, mode), [0, 0])
+            acc[0] += seconds
+            acc[1] += 1 if is_session_end else 0
+            if mode in MODE_COLUMNS or is_session_end:
+                self._logs.append((guild_id, user_id, ts, mode, seconds, day, week_bucket(day)))
+            if is_session_end:
+                self._streaks.add((guild_id, user_id, day))
+
+    # ── API ──
+    async def add(self, guild_id: int, entries: list, ts: float, day: int):
+        async with self._lock:
+            await self._journal({'guild_id': guild_id, 'ts': ts, 'day': day, 'entries': entries})
+            full = len(self._pending) + len(self._logs) >= self.threshold
+        if full:
+            task = asyncio.create_task(self.flush())
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+
+    async def discard(self, guild_id: int):
+        """Oublie les crédits en attente d'un serveur (clear_stats)."""
+        async with self._lock:
+            await self._journal({'guild_id': guild_id, 'discard': True})
+
+    def deltas(self, guild_id: int, user_id: int, seen_seq: int) -> dict:
+        """Crédits absents d'un instantané de la base où `last_seq == seen_seq`."""
+        sources = [batch for seq, batch in self._recent if seq > seen_seq]
+        sources.append(self._pending)
+        out = {}
+        for source in sources:
+            for (g, u, mode), (seconds, sessions) in source.items():
+                if g == guild_id and u == user_id:
+                    acc = out.setdefault(mode, [0, 0])
+                    acc[0] += seconds
+                    acc[1] += sessions
+        return out
+
+    async def flush(self):
+        async with self._flush_lock:
+            async with self._lock:
+                if not self._pending and not self._logs and not self._streaks:
+                    return
+                pending, logs, streaks, upto = self._pending, self._logs, self._streaks, self._seq
+                self._pending, self._logs, self._streaks = {}, [], set()
+                self._recent.append((upto, pending))
+                # Les lots suivants vont dans un nouveau journal
+                segment = self.journal_path.with_name(f'{self.journal_path.name}.{upto}')
+                if self.journal_path.exists():
+                    self.journal_path.replace(segment)
+
+            stats_rows = []
+            for (guild_id, user_id, mode), (seconds, sessions) in pending.items():
+                per_mode = [seconds if MODE_COLUMNS.get(mode) == col else 0
+                            for col in ('work_seconds_A', 'break_seconds_A',
+                                        'work_seconds_B', 'break_seconds_B')]
+                stats_rows.append((guild_id, user_id, seconds, seconds, *per_mode, sessions))
+            # Jours croissants : une session à cheval sur minuit compte dans l'ordre
+            streak_rows = [{'guild': g, 'user': u, 'day': day}
+                           for g, u, day in sorted(streaks, key=lambda s: s[2])]
+            guilds = {key[0] for key in pending} | {row[0] for row in logs}
+            stats_guilds = {key[0] for key in pending}
+            _begin_stats_write(stats_guilds)
+            try:
+                async with _db.writer() as db:
+                    await db.executemany(_UPSERT_STATS, stats_rows)
+                    await db.executemany(_INSERT_LOG, logs)
+                    await db.executemany(_UPSERT_STREAK, streak_rows)
+                    await db.execute(_SAVE_JOURNAL_SEQ, (upto,))
+                    ranked = await _fetch_ranked_rows(db, pending)
+            except BaseException:
+                # Remettre les crédits en attente ; le journal les contient toujours
+                async with self._lock:
+                    for key, (seconds, sessions) in pending.items():
+                        acc = self._pending.setdefault(key, [0, 0])
+                        acc[0] += seconds
+                        acc[1] += sessions
+                    self._logs[:0] = logs
+                    self._streaks |= streaks
+                    self._recent.remove((upto, pending))
+                _end_stats_write(stats_guilds)
+                raise
+            for guild_id in guilds:
+                _bump_generation(guild_id)
+            for guild_id, rows in ranked.items():
+                _leaderboards.observe(guild_id, rows)
+            _end_stats_write(stats_guilds)
+            for path in self._segments():
+                if path != self.journal_path and int(path.suffix[1:]) <= upto:
+                    path.unlink(missing_ok=True)
+
+    async def replay(self):
+        """Recharge les lots journalisés mais pas encore appliqués en base."""
+        async with _db.reader() as db:
+            cur = await db.execute("SELECT last_seq FROM journal_state WHERE id=1")
+            row = await cur.fetchone()
+        last_seq = row[0] if row else 0
+        replayed = 0
+        async with self._lock:
+            self._seq = last_seq
+            for path in self._segments():
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except ValueError:
+                            continue  # ligne tronquée par un crash : lot jamais acquitté
+                        self._seq = max(self._seq, record['seq'])
+                        if record['seq'] > last_seq:
+                            self._apply(record)
+                            replayed += 1
+        if replayed:
+            logger.info(f"{replayed} lot(s) rejoué(s) depuis le journal.")
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Échec du flush du tampon d'écriture")
+
+    async def start(self):
+        if self._task is not None:
+            return
+        await self.replay()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+_buffer = WriteBuffer(JOURNAL_PATH, FLUSH_INTERVAL, FLUSH_THRESHOLD)
+
+# Génération des données d'un serveur, incrémentée à chaque écriture visible
+_generations = {}
+
+def _bump_generation(guild_id: int):
+    _generations[guild_id] = _generations.get(guild_id, 0) + 1
+
+def get_generation(guild_id: int) -> int:
+    return _generations.get(guild_id, 0)
+
+# Compteur « écriture de stats en cours » par serveur, façon seqlock : impair
+# entre le début d'un flush (avant la transaction) et la fin de observe(). Un
+# TopK ou RankIndex lu pendant ce temps n'est pas mis en cache.
+_stats_writes = {}
+
+def _begin_stats_write(guild_ids):
+    for guild_id in guild_ids:
+        _stats_writes[guild_id] = _stats_writes.get(guild_id, 0) + 1
+
+def _end_stats_write(guild_ids):
+    # Second incrément : le compteur redevient pair
+    _begin_stats_write(guild_ids)
+
+async def _read_cacheable(guild_id: int, sql: str, params) -> tuple:
+    """(lignes, cacheable) : False si une écriture de stats a chevauché la lecture."""
+    seq = _stats_writes.get(guild_id, 0)
+    async with _db.reader() as db:
+        cur = await db.execute(sql, params)
+        rows = await cur.fetchall()
+    return rows, seq % 2 == 0 and seq == _stats_writes.get(guild_id, 0)
+
 async def ajouter_temps(user_id: int, guild_id: int, seconds: int,
                         mode: str = '', is_session_end: bool = False):
-    async with aiosqlite.connect(DB_PATH) as db:
-        # S'assurer que l’utilisateur existe
-        await db.execute("""
-            INSERT INTO stats(guild_id, user_id)
-            VALUES(?, ?)
-            ON CONFLICT(guild_id, user_id) DO NOTHING
-        """, (guild_id, user_id))
+    await ajouter_temps_many(guild_id, [(user_id, seconds, mode, is_session_end)])
 
-        # Mise à jour temps
-        await db.execute("""
-            UPDATE stats
-            SET seconds = seconds + ?,
-                total_seconds = total_seconds + ?
-            WHERE guild_id=? AND user_id=?
-        """, (seconds, seconds, guild_id, user_id))
-
-        if mode == 'A':
-            await db.execute("UPDATE stats SET work_seconds_A = work_seconds_A + ? WHERE guild_id=? AND user_id=?",
-                             (seconds, guild_id, user_id))
-        elif mode == 'A_break':
-            await db.execute("UPDATE stats SET break_seconds_A = break_seconds_A + ? WHERE guild_id=? AND user_id=?",
-                             (seconds, guild_id, user_id))
-        elif mode == 'B':
-            await db.execute("UPDATE stats SET work_seconds_B = work_seconds_B + ? WHERE guild_id=? AND user_id=?",
-                             (seconds, guild_id, user_id))
-        elif mode == 'B_break':
-            await db.execute("UPDATE stats SET break_seconds_B = break_seconds_B + ? WHERE guild_id=? AND user_id=?",
-                             (seconds, guild_id, user_id))
-
-        if is_session_end:
-            await db.execute("UPDATE stats SET session_count = session_count + 1 WHERE guild_id=? AND user_id=?",
-                             (guild_id, user_id))
-
-        # Log session
-        if mode in ('A', 'A_break', 'B', 'B_break') or is_session_end:
-            ts = datetime.now(timezone.utc).timestamp()
-            await db.execute("""
-                INSERT OR IGNORE INTO session_logs
-                (guild_id, user_id, timestamp, mode, duration)
-                VALUES (?, ?, ?, ?, ?)
-            """, (guild_id, user_id, ts, mode or '', seconds))
+async def ajouter_temps_many(guild_id: int, entries):
+    """Crédite plusieurs utilisateurs d'un coup.
+
+    `entries` : itérable de (user_id, seconds, mode, is_session_end). Les crédits
+    passent par le tampon d'écriture et sont appliqués en une seule transaction
+    au prochain flush.
+    """
+    entries = [[user_id, seconds, mode or '', bool(is_session_end)]
+               for user_id, seconds, mode, is_session_end in entries]
+    if not entries:
+        return
+    ts = datetime.now(timezone.utc).timestamp()
+    day = day_bucket(ts, await get_guild_timezone(guild_id))
+    await _buffer.add(guild_id, entries, ts, day)
 
-        await db.commit()
+async def flush_writes():
+    """Force l'écriture en base des crédits en attente."""
+    await _buffer.flush()
 
 # ─── RÉCUPÉRATION D'UN UTILISATEUR ─────────────────────────────────────────────
 async def recuperer_temps(user_id: int, guild_id: int) -> dict:
-    async with aiosqlite.connect(DB_PATH) as db:
+    """Stats d'un utilisateur, crédits encore dans le tampon inclus."""
+    async with _db.reader() as db:
+        # last_seq lu dans la même requête : indique quels flush l'instantané contient
         cur = await db.execute("""
-            SELECT seconds, total_seconds, work_seconds_A, break_seconds_A,
-                   work_seconds_B, break_seconds_B, session_count
-            FROM stats WHERE guild_id=? AND user_id=?
+            SELECT (SELECT last_seq FROM journal_state WHERE id=1),
+                   s.seconds, s.total_seconds, s.work_seconds_A, s.break_seconds_A,
+                   s.work_seconds_B, s.break_seconds_B, s.session_count
+            FROM (SELECT 1)
+            LEFT JOIN stats s ON s.guild_id=? AND s.user_id=?
         """, (guild_id, user_id))
-        row = await cur.fetchone()
-        if not row:
-            return dict.fromkeys([
-                'seconds','total_seconds',
-                'work_seconds_A','break_seconds_A',
-                'work_seconds_B','break_seconds_B',
-                'session_count'
-            ], 0)
-        return {
-            'seconds': row[0], 'total_seconds': row[1],
-            'work_seconds_A': row[2], 'break_seconds_A': row[3],
-            'work_seconds_B': row[4], 'break_seconds_B': row[5],
-            'session_count': row[6]
-        }
+        seen_seq, *row = await cur.fetchone()
+
+    return _merge_buffered(guild_id, user_id, seen_seq, row)
+
+_STATS_KEYS = ['seconds', 'total_seconds',
+               'work_seconds_A', 'break_seconds_A',
+               'work_seconds_B', 'break_seconds_B',
+               'session_count']
+
+def _merge_buffered(guild_id: int, user_id: int, seen_seq, row) -> dict:
+    """Ligne `stats` lue + crédits du tampon que l'instantané ne contient pas."""
+    result = dict(zip(_STATS_KEYS, (v or 0 for v in row)))
+    deltas = _buffer.deltas(guild_id, user_id, seen_seq or 0)
+    for mode, (seconds, sessions) in deltas.items():
+        result['seconds'] += seconds
+        result['total_seconds'] += seconds
+        if mode in MODE_COLUMNS:
+            result[MODE_COLUMNS[mode]] += seconds
+        result['session_count'] += sessions
+    return result
+
+class UserProfile(NamedTuple):
+    """Session, stats et streaks de *me, lus dans un seul instantané (rangs : get_ranks)."""
+    join_ts: Optional[float]  # None si pas en session
+    mode: Optional[str]
+    stats: dict               # mêmes clés que recuperer_temps
+    current_streak: int
+    best_streak: int
+
+async def get_user_profile(guild_id: int, user_id: int) -> UserProfile:
+    """Session, stats et streak d'un utilisateur en une requête.
+
+    Une seule instruction SELECT = un seul instantané de lecture : un flush
+    concurrent est vu entièrement ou pas du tout, et last_seq dit lequel.
+    """
+    today = await _today(guild_id)
+    async with _db.reader() as db:
+        cur = await db.execute("""
+            SELECT (SELECT last_seq FROM journal_state WHERE id=1),
+                   p.join_ts, p.mode,
+                   s.seconds, s.total_seconds, s.work_seconds_A, s.break_seconds_A,
+                   s.work_seconds_B, s.break_seconds_B, s.session_count,
+                   {live}, k.best_streak
+            FROM (SELECT 1)
+            LEFT JOIN participants p ON p.guild_id = :guild AND p.user_id = :user
+            LEFT JOIN stats s        ON s.guild_id = :guild AND s.user_id = :user
+            LEFT JOIN streaks k      ON k.guild_id = :guild AND k.user_id = :user
+        """.format(live=_LIVE_STREAK.format(t='k')), {'guild': guild_id, 'user': user_id, 'today': today})
+        seen_seq, join_ts, mode, *rest = await cur.fetchone()
+
+    stats_row, (current, best) = rest[:7], rest[7:]
+    return UserProfile(join_ts, mode, _merge_buffered(guild_id, user_id, seen_seq, stats_row),
+                       current or 0, best or 0)
 
 # ─── LISTES & CLASSEMENTS ──────────────────────────────────────────────────────
+_leaderboards = ranking.Leaderboards()
+
+async def _fetch_ranked_rows(db, pending: dict, chunk: int = 500) -> dict:
+    """Valeurs absolues des lignes `stats` modifiées, pour les TopK et RankIndex chargés."""
+    users = {}
+    for guild_id, user_id, _ in pending:
+        users.setdefault(guild_id, set()).add(user_id)
+    users = {guild_id: ids for guild_id, ids in users.items() if _leaderboards.has_guild(guild_id)}
+    out = {}
+    for guild_id, ids in users.items():
+        ids = list(ids)
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            cur = await db.execute(f"""
+                SELECT user_id, total_seconds, work_seconds_A, work_seconds_B, session_count
+                FROM stats
+                WHERE guild_id=? AND user_id IN ({','.join('?' * len(part))})
+            """, (guild_id, *part))
+            out.setdefault(guild_id, []).extend(await cur.fetchall())
+    return out
+
+async def get_top(guild_id: int, metric: str, n: int = 10) -> list:
+    """[(user_id, valeur)] des n meilleurs pour une métrique de ranking.METRICS."""
+    board = _leaderboards.get(guild_id, metric)
+    if board is None:
+        expr, where, index, _ = ranking.METRICS[metric]
+        rows, cacheable = await _read_cacheable(guild_id, f"""
+            SELECT user_id, {expr} FROM stats INDEXED BY {index}
+            WHERE guild_id=? AND {where}
+            ORDER BY {expr} DESC, user_id DESC
+            LIMIT ?
+        """, (guild_id, _leaderboards.k))
+        # Un flush pendant la lecture : on sert le résultat sans le mettre en cache
+        if not cacheable:
+            return rows[:n]
+        board = _leaderboards.load(guild_id, metric, rows)
+    return board.top(n)
+
+class Rank(NamedTuple):
+    rank: int
+    total: int  # utilisateurs classés pour cette métrique
+
+    @property
+    def percentile(self) -> float:
+        """Part des classés que l'utilisateur devance ou égale (100 = premier)."""
+        return 100 * (self.total - self.rank + 1) / self.total
+
+async def _rank_index(guild_id: int, metric: str) -> ranking.RankIndex:
+    index = _leaderboards.get_ranks(guild_id, metric)
+    if index is None:
+        # Chargé une fois par (serveur, métrique) en parcourant l'index couvrant,
+        # puis tenu à jour à chaque flush (voir _fetch_ranked_rows)
+        expr, where, idx, _ = ranking.METRICS[metric]
+        rows, cacheable = await _read_cacheable(guild_id, f"""
+            SELECT user_id, {expr} FROM stats INDEXED BY {idx}
+            WHERE guild_id=? AND {where} AND {expr} > 0
+        """, (guild_id,))
+        if not cacheable:
+            return ranking.RankIndex(rows)
+        index = _leaderboards.load_ranks(guild_id, metric, rows)
+    return index
+
+async def get_ranks(guild_id: int, user_id: int, metrics=tuple(ranking.METRICS),
+                    stats: dict = None) -> dict:
+    """{métrique: Rank ou None} ; rang par bisection, dans l'ordre des classements.
+
+    L'utilisateur est classé avec ses stats tampon compris (`stats`, au format de
+    recuperer_temps, lues si absentes) : son rang suit ce qu'affiche *me. Les
+    autres membres comptent pour leurs valeurs au dernier flush.
+    """
+    if stats is None:
+        stats = await recuperer_temps(user_id, guild_id)
+    row = (user_id, stats['total_seconds'], stats['work_seconds_A'],
+           stats['work_seconds_B'], stats['session_count'])
+    out = {}
+    for metric in metrics:
+        index = await _rank_index(guild_id, metric)
+        ranked = index.rank_of(user_id, ranking.METRICS[metric][3](row))
+        out[metric] = Rank(*ranked) if ranked is not None else None
+    return out
+
 async def get_all_stats(guild_id: int) -> list:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.reader() as db:
         cur = await db.execute("""
             SELECT user_id, seconds, total_seconds,
                    work_seconds_A, break_seconds_A,
@@ -170,30 +907,76 @@ async def get_all_stats(guild_id: int) -> list:
         return await cur.fetchall()
 
 async def classement_top10(guild_id: int) -> list:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("""
-            SELECT user_id, total_seconds
-            FROM stats
-            WHERE guild_id=?
-            ORDER BY total_seconds DESC
-            LIMIT 10
-        """, (guild_id,))
-        return await cur.fetchall()
+    return await get_top(guild_id, 'total', 10)
+
+# métrique -> (table, expression, filtre, index dont l'ordre est (guild_id, expression, user_id))
+_PAGE_SOURCES = {
+    **{metric: ('stats', expr, where, index) for metric, (expr, where, index, _) in ranking.METRICS.items()},
+    'streaks': ('streaks', 'current_streak', 'current_streak > 0 AND last_day >= :today - 1',
+                'idx_streaks_top'),
+}
+LEADERBOARD_METRICS = tuple(_PAGE_SOURCES)
+
+class LeaderboardPage(NamedTuple):
+    rows: list       # [(user_id, valeur)], meilleur d'abord
+    has_prev: bool
+    has_next: bool
+
+async def get_leaderboard_page(guild_id: int, metric: str, size: int = 10,
+                               after: tuple = None, before: tuple = None,
+                               offset: int = 0) -> LeaderboardPage:
+    """Une page de classement par pagination par clé sur (valeur, user_id).
+
+    `after` / `before` : dernière / première ligne (user_id, valeur) de la page
+    affichée. Chaque page est une recherche par intervalle dans l'index,
+    quelle que soit sa profondeur ; `offset` ne sert qu'à un saut direct.
+    """
+    table, expr, where, index = _PAGE_SOURCES[metric]
+    params = {'guild': guild_id, 'today': await _today(guild_id),
+              'limit': size + 1, 'offset': offset if after is None and before is None else 0}
+    # Borne simple en plus de la valeur de ligne : seule la première sait
+    # utiliser un index d'expression (avg)
+    if before is not None:
+        cond, order = f"AND {expr} >= :value AND ({expr}, user_id) > (:value, :user)", 'ASC'
+        params.update(user=before[0], value=before[1])
+    elif after is not None:
+        cond, order = f"AND {expr} <= :value AND ({expr}, user_id) < (:value, :user)", 'DESC'
+        params.update(user=after[0], value=after[1])
+    else:
+        cond, order = '', 'DESC'
+    async with _db.reader() as db:
+        cur = await db.execute(f"""
+            SELECT user_id, {expr} FROM {table} INDEXED BY {index}
+            WHERE guild_id=:guild AND {where} {cond}
+            ORDER BY {expr} {order}, user_id {order}
+            LIMIT :limit OFFSET :offset
+        """, params)
+        rows = await cur.fetchall()
+    more = len(rows) > size
+    rows = rows[:size]
+    if before is not None:
+        return LeaderboardPage(rows[::-1], more, True)
+    return LeaderboardPage(rows, after is not None or offset > 0, more)
 
 # ─── PARTICIPANTS ──────────────────────────────────────────────────────────────
 async def add_participant(user_id: int, guild_id: int, mode: str):
     now = datetime.now(timezone.utc).timestamp()
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.writer() as db:
         await db.execute("""
             INSERT INTO participants(guild_id, user_id, join_ts, mode)
             VALUES(?, ?, ?, ?)
             ON CONFLICT(guild_id, user_id) DO UPDATE
               SET join_ts=excluded.join_ts, mode=excluded.mode
         """, (guild_id, user_id, now, mode))
-        await db.commit()
+
+async def get_participant(user_id: int, guild_id: int):
+    async with _db.reader() as db:
+        cur = await db.execute("SELECT join_ts, mode FROM participants WHERE guild_id=? AND user_id=?",
+                               (guild_id, user_id))
+        return await cur.fetchone()  # (join_ts, mode) ou None
 
 async def remove_participant(user_id: int, guild_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.writer() as db:
         cur = await db.execute("SELECT join_ts, mode FROM participants WHERE guild_id=? AND user_id=?",
                                (guild_id, user_id))
         row = await cur.fetchone()
@@ -201,117 +984,443 @@ async def remove_participant(user_id: int, guild_id: int):
             return None, None
         await db.execute("DELETE FROM participants WHERE guild_id=? AND user_id=?",
                          (guild_id, user_id))
-        await db.commit()
         return row  # (join_ts, mode)
 
+async def remove_all_participants(guild_id: int) -> list:
+    """Vide les participants du serveur et retourne [(user_id, join_ts, mode), ...]."""
+    async with _db.writer() as db:
+        cur = await db.execute("SELECT user_id, join_ts, mode FROM participants WHERE guild_id=?",
+                               (guild_id,))
+        rows = await cur.fetchall()
+        await db.execute("DELETE FROM participants WHERE guild_id=?", (guild_id,))
+        return rows
+
+async def load_all_participants() -> list:
+    """[(guild_id, user_id, join_ts, mode)] de tous les serveurs (redémarrage à chaud)."""
+    async with _db.reader() as db:
+        cur = await db.execute("SELECT guild_id, user_id, join_ts, mode FROM participants")
+        return await cur.fetchall()
+
 async def get_all_participants(guild_id: int) -> list:
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.reader() as db:
         cur = await db.execute("SELECT user_id, mode FROM participants WHERE guild_id=?",
                                (guild_id,))
         return await cur.fetchall()
 
 # ─── NOUVELLES MÉTRIQUES ───────────────────────────────────────────────────────
+# Logs bruts et agrégats de rétention sont disjoints : une ligne est dans l'un ou l'autre
+
 async def get_daily_totals(guild_id: int, days: int = 7) -> list:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(f"""
-            SELECT date(datetime(timestamp, 'unixepoch', 'localtime')) AS day,
-                   SUM(duration)
-            FROM session_logs
-            WHERE guild_id=?
-              AND timestamp >= strftime('%s','now','-{days} days')
+    """[(jour 'YYYY-MM-DD', secondes)] des `days` derniers jours locaux."""
+    today = await _today(guild_id)
+    async with _db.reader() as db:
+        cur = await db.execute("""
+            SELECT date(day * 86400, 'unixepoch'), SUM(seconds)
+            FROM (
+                SELECT day_bucket AS day, duration AS seconds FROM session_logs
+                WHERE guild_id=:guild AND day_bucket > :since
+                UNION ALL
+                SELECT day_bucket, seconds FROM daily_user_totals
+                WHERE guild_id=:guild AND day_bucket > :since
+            )
             GROUP BY day
             ORDER BY day
-        """, (guild_id,))
+        """, {'guild': guild_id, 'since': today - days})
         return await cur.fetchall()
 
 async def get_weekly_sessions(guild_id: int, weeks: int = 4) -> list:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(f"""
-            SELECT strftime('%Y-W%W', timestamp, 'unixepoch', 'localtime') AS yw,
-                   COUNT(*)
-            FROM session_logs
-            WHERE guild_id=?
-              AND timestamp >= strftime('%s','now','-{weeks} weeks')
-            GROUP BY yw
-            ORDER BY yw
-        """, (guild_id,))
+    """[(semaine 'YYYY-Www', nombre de logs)] des `weeks` dernières semaines."""
+    today = await _today(guild_id)
+    since = week_bucket(today) - weeks
+    async with _db.reader() as db:
+        # week_bucket > since  <=>  day_bucket >= 7 * since + 4
+        cur = await db.execute("""
+            SELECT strftime('%Y-W%W', (week * 7 - 3) * 86400, 'unixepoch'), SUM(n)
+            FROM (
+                SELECT week_bucket AS week, COUNT(*) AS n FROM session_logs
+                WHERE guild_id=:guild AND week_bucket > :since
+                GROUP BY week_bucket
+                UNION ALL
+                SELECT (day_bucket + 3) / 7, SUM(sessions) FROM daily_user_totals
+                WHERE guild_id=:guild AND day_bucket >= 7 * :since + 4
+                GROUP BY (day_bucket + 3) / 7
+            )
+            GROUP BY week
+            ORDER BY week
+        """, {'guild': guild_id, 'since': since})
         return await cur.fetchall()
 
-# ─── STREAKS ───────────────────────────────────────────────────────────────────
-TIMEZONE = ZoneInfo("Europe/Zurich")
+# ─── RÉTENTION ─────────────────────────────────────────────────────────────────
+_UPSERT_DAILY = """
+    INSERT INTO daily_user_totals(guild_id, day_bucket, user_id, mode, seconds, sessions)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(guild_id, day_bucket, user_id, mode) DO UPDATE SET
+        seconds  = seconds  + excluded.seconds,
+        sessions = sessions + excluded.sessions
+"""
 
-async def update_streak(guild_id: int, user_id: int):
-    """Met à jour le streak après une session."""
-    today = datetime.now(TIMEZONE).date()
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute(
-            "SELECT current_streak, best_streak, last_session_date FROM streaks WHERE guild_id=? AND user_id=?",
-            (guild_id, user_id),
-        )
-        row = await cursor.fetchone()
+class RetentionJob:
+    """Agrège les logs plus vieux que `days` jours dans daily_user_totals.
 
-        if row is None:
-            await db.execute(
-                "INSERT INTO streaks (guild_id, user_id, current_streak, best_streak, last_session_date) VALUES (?, ?, ?, ?, ?)",
-                (guild_id, user_id, 1, 1, today.isoformat()),
-            )
-        else:
-            current_streak, best_streak, last_date = row
-            last_date = datetime.fromisoformat(last_date).date() if last_date else None
-
-            if last_date == today:
-                pass
-            elif last_date == today - timedelta(days=1):
-                current_streak += 1
-                best_streak = max(best_streak, current_streak)
-                await db.execute(
-                    "UPDATE streaks SET current_streak=?, best_streak=?, last_session_date=? WHERE guild_id=? AND user_id=?",
-                    (current_streak, best_streak, today.isoformat(), guild_id, user_id),
-                )
-            else:
-                await db.execute(
-                    "UPDATE streaks SET current_streak=?, last_session_date=? WHERE guild_id=? AND user_id=?",
-                    (1, today.isoformat(), guild_id, user_id),
-                )
+    Chaque lot de `chunk` lignes est agrégé puis supprimé dans la même
+    transaction (jamais compté deux fois), et le verrou d'écriture est rendu
+    entre deux lots pour laisser passer les flush. Les pages libérées sont
+    ensuite rendues au système par incremental_vacuum.
+    """
+
+    def __init__(self, days: int, interval_hours: float, chunk: int = 2000):
+        self.days = days
+        self.interval = interval_hours * 3600
+        self.chunk = chunk
+        self._task = None
+        self.rolled_up = 0  # lignes agrégées depuis le démarrage
+
+    async def _roll_chunk(self, guild_id: int, cutoff: int) -> int:
+        async with _db.writer() as db:
+            cur = await db.execute("""
+                SELECT rowid, user_id, day_bucket, mode, duration FROM session_logs
+                WHERE guild_id=? AND day_bucket < ?
+                LIMIT ?
+            """, (guild_id, cutoff, self.chunk))
+            rows = await cur.fetchall()
+            if not rows:
+                return 0
+            totals = {}
+            for _, user_id, day, mode, duration in rows:
+                acc = totals.setdefault((day, user_id, mode), [0, 0])
+                acc[0] += duration or 0
+                acc[1] += 1
+            await db.executemany(_UPSERT_DAILY, [(guild_id, day, user_id, mode, seconds, sessions)
+                                                 for (day, user_id, mode), (seconds, sessions) in totals.items()])
+            await db.executemany("DELETE FROM session_logs WHERE rowid=?", [(r[0],) for r in rows])
+        return len(rows)
+
+    async def vacuum(self, pages: int = 1000):
+        """Rend les pages libres par petites tranches."""
+        while True:
+            async with _db.writer() as db:
+                cur = await db.execute("PRAGMA freelist_count")
+                if (await cur.fetchone())[0] == 0:
+                    return
+                await db.execute(f"PRAGMA incremental_vacuum({pages})")
+            await asyncio.sleep(0)
+
+    async def run_once(self) -> int:
+        if self.days <= 0:
+            return 0
+        # Jour UTC : à un jour près selon le fuseau, sans effet sur les totaux
+        cutoff = day_bucket(datetime.now(timezone.utc).timestamp(), timezone.utc) - self.days
+        async with _db.reader() as db:
+            cur = await db.execute("SELECT DISTINCT guild_id FROM session_logs")
+            guilds = [row[0] for row in await cur.fetchall()]
+        moved = 0
+        for guild_id in guilds:
+            while (count := await self._roll_chunk(guild_id, cutoff)):
+                moved += count
+                await asyncio.sleep(0)
+        if moved:
+            await self.vacuum()
+            self.rolled_up += moved
+            logger.info(f"Rétention : {moved} log(s) agrégé(s) dans daily_user_totals.")
+        return moved
 
-        await db.commit()
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Échec de la passe de rétention")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.days > 0:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+_retention = RetentionJob(RETENTION_DAYS, RETENTION_INTERVAL)
+
+# ─── STREAKS ───────────────────────────────────────────────────────────────────
+async def update_streak(guild_id: int, user_id: int, day: int = None):
+    """Met à jour le streak après une session (le flush du tampon fait de même en lot)."""
+    if day is None:
+        day = await _today(guild_id)
+    async with _db.writer() as db:
+        await db.execute(_UPSERT_STREAK, {'guild': guild_id, 'user': user_id, 'day': day})
+    _bump_generation(guild_id)
 
 async def get_streak(guild_id: int, user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT current_streak, best_streak FROM streaks WHERE guild_id=? AND user_id=?",
-                               (guild_id, user_id))
+    """(streak en cours, meilleur streak), décroissance appliquée à la lecture."""
+    async with _db.reader() as db:
+        cur = await db.execute(f"""
+            SELECT {_LIVE_STREAK.format(t='streaks')}, best_streak
+            FROM streaks WHERE guild_id=:guild AND user_id=:user
+        """, {'guild': guild_id, 'user': user_id, 'today': await _today(guild_id)})
         row = await cur.fetchone()
         return row if row else (0, 0)
 
 async def top_streaks(guild_id: int, limit: int = 5):
-    async with aiosqlite.connect(DB_PATH) as db:
+    """[(user_id, streak en cours, meilleur)] des streaks encore vivants."""
+    async with _db.reader() as db:
         cur = await db.execute("""
             SELECT user_id, current_streak, best_streak
-            FROM streaks
-            WHERE guild_id=?
-            ORDER BY current_streak DESC
-            LIMIT ?
-        """, (guild_id, limit))
+            FROM streaks INDEXED BY idx_streaks_top
+            WHERE guild_id=:guild AND current_streak > 0 AND last_day >= :today - 1
+            ORDER BY current_streak DESC, user_id DESC
+            LIMIT :limit
+        """, {'guild': guild_id, 'today': await _today(guild_id), 'limit': limit})
         return await cur.fetchall()
 
-# ─── SETTINGS ────────────────────────────────────────────────────────────────
+async def rebuild_streaks(guild_id: int) -> int:
+    """Recalcule les streaks d'un serveur depuis session_logs ; renvoie le nombre d'utilisateurs.
+
+    Un seul passage groupé : jours distincts de fin de session par utilisateur
+    (logs bruts et agrégats de rétention),
+    dans l'ordre, puis séries de jours consécutifs calculées au fil de l'eau.
+    """
+    await _buffer.flush()
+    async with _db.writer() as db:
+        cur = await db.execute("""
+            SELECT user_id, day_bucket FROM session_logs
+            WHERE guild_id=:guild AND day_bucket IS NOT NULL AND substr(mode, -6) != '_break'
+            UNION
+            SELECT user_id, day_bucket FROM daily_user_totals
+            WHERE guild_id=:guild AND substr(mode, -6) != '_break'
+            ORDER BY user_id, day_bucket
+        """, {'guild': guild_id})
+        rows, user, current, best, last = [], None, 0, 0, None
+        for user_id, day in await cur.fetchall():
+            if user_id != user:
+                if user is not None:
+                    rows.append((guild_id, user, current, best, last, last))
+                user, current, best = user_id, 0, 0
+            current = current + 1 if last == day - 1 and current else 1
+            best, last = max(best, current), day
+        if user is not None:
+            rows.append((guild_id, user, current, best, last, last))
+
+        await db.execute("DELETE FROM streaks WHERE guild_id=?", (guild_id,))
+        await db.executemany("""
+            INSERT INTO streaks(guild_id, user_id, current_streak, best_streak, last_day, last_session_date)
+            VALUES (?, ?, ?, ?, ?, date(? * 86400, 'unixepoch'))
+        """, rows)
+    _bump_generation(guild_id)
+    return len(rows)
+
+async def clear_guild_stats(guild_id: int):
+    """Supprime stats, historique et streaks d'un serveur."""
+    await _buffer.flush()
+    await _buffer.discard(guild_id)
+    _begin_stats_write((guild_id,))
+    try:
+        async with _db.writer() as db:
+            await db.execute("DELETE FROM stats WHERE guild_id=?", (guild_id,))
+            await db.execute("DELETE FROM session_logs WHERE guild_id=?", (guild_id,))
+            await db.execute("DELETE FROM daily_user_totals WHERE guild_id=?", (guild_id,))
+            await db.execute("DELETE FROM streaks WHERE guild_id=?", (guild_id,))
+        _leaderboards.invalidate(guild_id)
+        _bump_generation(guild_id)
+    finally:
+        _end_stats_write((guild_id,))
+
+# ─── NOMS D'UTILISATEURS ───────────────────────────────────────────────────────
+async def get_user_names(user_ids: list) -> dict:
+    """{user_id: (name, updated_at)} pour les identifiants connus."""
+    user_ids = list(user_ids)
+    out = {}
+    async with _db.reader() as db:
+        for i in range(0, len(user_ids), 500):
+            part = user_ids[i:i + 500]
+            cur = await db.execute(
+                f"SELECT user_id, name, updated_at FROM user_names WHERE user_id IN ({','.join('?' * len(part))})",
+                part,
+            )
+            for user_id, name, updated_at in await cur.fetchall():
+                out[user_id] = (name, updated_at)
+    return out
+
+async def save_user_names(names: dict):
+    """Enregistre {user_id: name}."""
+    if not names:
+        return
+    now = datetime.now(timezone.utc).timestamp()
+    async with _db.writer() as db:
+        await db.executemany("""
+            INSERT INTO user_names (user_id, name, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET name=excluded.name, updated_at=excluded.updated_at
+        """, [(user_id, name, now) for user_id, name in names.items()])
+
+# ─── RÉGLAGES ──────────────────────────────────────────────────────────────────
+class SettingsStore:
+    """Table settings gardée en mémoire.
+
+    Chargée en une requête au démarrage, puis mise à jour en écriture directe
+    par `set_setting` : les lectures ne touchent jamais la base. Un serveur sans
+    réglage propre retombe sur [CURRENT_SETTINGS] de settings.ini. Le serveur 0
+    porte les réglages globaux (durées des cycles, heartbeat).
+    """
+
+    def __init__(self):
+        self._values = {}  # guild_id -> {clé: valeur}
+
+    async def load(self):
+        async with _db.reader() as db:
+            cur = await db.execute("SELECT guild_id, key, value FROM settings")
+            rows = await cur.fetchall()
+        self._values = {}
+        for guild_id, key, value in rows:
+            self._values.setdefault(guild_id, {})[key] = value
+
+    def get(self, guild_id: int, key: str, default=None):
+        value = self._values.get(guild_id, {}).get(key)
+        return default if value is None else value
+
+    def put(self, guild_id: int, key: str, value: str):
+        self._values.setdefault(guild_id, {})[key] = value
+
+    @staticmethod
+    def ini(key: str, default=None):
+        return _storage_config.get('CURRENT_SETTINGS', key, fallback=default)
+
+_settings = SettingsStore()
+
 async def get_setting(guild_id: int, key: str, default=None):
     """Lire une valeur dans settings"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT value FROM settings WHERE guild_id=? AND key=?",
-            (guild_id, key),
-        )
-        row = await cur.fetchone()
-        return row[0] if row else default
+    return _settings.get(guild_id, key, default)
 
 
 async def set_setting(guild_id: int, key: str, value: str):
     """Écrire ou mettre à jour une valeur dans settings"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with _db.writer() as db:
         await db.execute("""
             INSERT INTO settings (guild_id, key, value)
             VALUES (?, ?, ?)
             ON CONFLICT(guild_id, key) DO UPDATE SET value=excluded.value
         """, (guild_id, key, str(value)))
-        await db.commit()
+    _settings.put(guild_id, key, str(value))
+    if key == 'timezone':
+        _guild_timezones.pop(guild_id, None)
+
+# Accès typés, sans I/O
+def get_maintenance(guild_id: int) -> bool:
+    return _settings.get(guild_id, 'maintenance_mode', _settings.ini('maintenance_mode', 'false')) == 'true'
+
+async def set_maintenance(guild_id: int, enabled: bool):
+    await set_setting(guild_id, 'maintenance_mode', 'true' if enabled else 'false')
+
+def get_channel_id(guild_id: int):
+    """Salon Pomodoro du serveur, ou None (le salon de settings.ini est résolu par le bot)."""
+    value = _settings.get(guild_id, 'channel_id')
+    return int(value) if value else None
+
+def get_role_setting(guild_id: int, mode: str) -> tuple:
+    """(role_id ou None, nom) du rôle Pomodoro d'un mode."""
+    role_id = _settings.get(guild_id, f'pomodoro_role_id_{mode}')
+    name = _settings.get(guild_id, f'pomodoro_role_{mode}',
+                         _settings.ini(f'pomodoro_role_{mode}', '50-10' if mode == 'A' else '25-5'))
+    return (int(role_id) if role_id else None), name
+
+async def set_role_setting(guild_id: int, mode: str, role_id: int, name: str):
+    await set_setting(guild_id, f'pomodoro_role_id_{mode}', role_id)
+    await set_setting(guild_id, f'pomodoro_role_{mode}', name)
+
+_CYCLE_DEFAULTS = {'A': (50, 10), 'B': (25, 5)}
+
+def get_cycle_minutes(mode: str) -> tuple:
+    """(travail, pause) en minutes ; réglage global du serveur 0, sinon settings.ini."""
+    work, brk = _CYCLE_DEFAULTS[mode]
+    return (int(_settings.get(0, f'work_time_{mode}', _settings.ini(f'work_time_{mode}', work))),
+            int(_settings.get(0, f'break_time_{mode}', _settings.ini(f'break_time_{mode}', brk))))
+
+# Dernier signe de vie du bot, pour mesurer la durée d'une interruption
+async def get_heartbeat():
+    value = await get_setting(0, 'heartbeat_ts')
+    return float(value) if value else None
+
+async def set_heartbeat(ts: float):
+    await set_setting(0, 'heartbeat_ts', ts)
+
+# ─── ANALYSES ──────────────────────────────────────────────────────────────────
+ACTIVITY_MODES = ('A', 'A_break', 'B', 'B_break')  # code numérique -> mode
+_MODE_CODE = ("CASE mode WHEN 'A' THEN 0 WHEN 'A_break' THEN 1 "
+              "WHEN 'B' THEN 2 WHEN 'B_break' THEN 3 ELSE -1 END")
+
+async def fetch_activity(guild_id: int, days: int) -> list:
+    """Activité des `days` derniers jours locaux, en une requête, tout numérique.
+
+    [(user_id, timestamp, day_bucket, code mode, secondes, sessions)] : logs bruts
+    (timestamp de fin, 1 session) puis agrégats de rétention (timestamp -1).
+    Une seule instruction : un passage de rétention est vu entièrement ou pas du tout.
+    """
+    since = await _today(guild_id) - days
+    async with _db.reader() as db:
+        cur = await db.execute(f"""
+            SELECT user_id, timestamp, day_bucket, {_MODE_CODE}, IFNULL(duration, 0), 1
+            FROM session_logs
+            WHERE guild_id=:guild AND day_bucket > :since
+            UNION ALL
+            SELECT user_id, -1, day_bucket, {_MODE_CODE}, seconds, sessions
+            FROM daily_user_totals
+            WHERE guild_id=:guild AND day_bucket > :since
+        """, {'guild': guild_id, 'since': since})
+        return await cur.fetchall()
+
+# ─── EXPORT ────────────────────────────────────────────────────────────────────
+# Filtre temporel : timestamp (idx_session_logs_guild_ts) ou jour local (clé primaire)
+_EXPORT_QUERIES = {
+    'session_logs': """
+        SELECT user_id, timestamp, mode, duration, day_bucket FROM session_logs
+        WHERE guild_id=:guild AND timestamp >= :since AND timestamp < :until
+        ORDER BY timestamp
+    """,
+    'daily_user_totals': """
+        SELECT date(day_bucket * 86400, 'unixepoch') AS day, user_id, mode, seconds, sessions
+        FROM daily_user_totals
+        WHERE guild_id=:guild AND day_bucket >= :since_day AND day_bucket < :until_day
+        ORDER BY day_bucket
+    """,
+    'stats': """
+        SELECT user_id, total_seconds, work_seconds_A, break_seconds_A,
+               work_seconds_B, break_seconds_B, session_count
+        FROM stats WHERE guild_id=:guild
+    """,
+    'streaks': """
+        SELECT user_id, current_streak, best_streak,
+               date(last_day * 86400, 'unixepoch') AS last_day
+        FROM streaks WHERE guild_id=:guild
+    """,
+}
+EXPORT_TABLES = tuple(_EXPORT_QUERIES)
+
+async def iter_export(guild_id: int, table: str, since: float = None, until: float = None,
+                      chunk: int = 1000):
+    """Parcourt une table d'un serveur par lots : (colonnes, lignes) à chaque lot.
+
+    Le curseur est lu par `fetchmany`, jamais en entier. `since`/`until` (epoch)
+    ne filtrent que session_logs et daily_user_totals ; pour ces derniers, les
+    bornes sont ramenées en jours locaux du serveur, comme day_bucket. La
+    connexion de lecture est gardée jusqu'à la fin : l'export voit un instantané
+    cohérent.
+    """
+    tz = await get_guild_timezone(guild_id)
+    params = {
+        'guild': guild_id,
+        'since': since if since is not None else 0,
+        'until': until if until is not None else 2 ** 53,
+        'since_day': day_bucket(since, tz) if since is not None else -2 ** 31,
+        # Jour local contenant la dernière seconde de la fenêtre, inclus
+        'until_day': day_bucket(until - 1, tz) + 1 if until is not None else 2 ** 31,
+    }
+    async with _db.reader() as db:
+        cur = await db.execute(_EXPORT_QUERIES[table], params)
+        columns = [col[0] for col in cur.description]
+        while rows := await cur.fetchmany(chunk):
+            yield columns, rows
+        await cur.close()
+
+# ─── INSTRUMENTATION ───────────────────────────────────────────────────────────
+# Chaque coroutine publique de ce module est chronométrée (famille 'db', voir perf.py)
+perf.instrument_module(sys.modules[__name__], 'db')
@@ -0,0 +1,148 @@
+# dispatcher.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger('pomodoro_bot.dispatcher')
+
+# Priorités : plus petit = envoyé d'abord
+ANNOUNCEMENT = 0
+REPLY = 1
+
+# ─── FILE PAR SALON ────────────────────────────────────────────────────────────
+class _Outbound:
+    __slots__ = ('priority', 'content', 'kwargs', 'merge_key', 'deadline', 'queued_at', 'future')
+
+    def __init__(self, priority, content, kwargs, merge_key, deadline):
+        self.priority = priority
+        self.content = content
+        self.kwargs = kwargs
+        self.merge_key = merge_key
+        self.deadline = deadline
+        self.queued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+class _ChannelQueue:
+    def __init__(self, channel, burst: int):
+        self.channel = channel
+        self.heap = []       # (priorité, n° d'ordre, _Outbound)
+        self.mergeable = {}  # merge_key -> _Outbound encore en attente
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.worker = None
+
+# ─── RÉPARTITEUR ───────────────────────────────────────────────────────────────
+class Dispatcher:
+    """Envoi des messages sortants, salon par salon.
+
+    Chaque salon a sa file à priorité (annonces de phase avant les réponses aux
+    commandes) et son seau à jetons : `burst` messages d'un coup, puis `rate`
+    par seconde, sous la limite de Discord (5 messages / 5 s par salon). Deux
+    annonces en attente avec la même `merge_key` (les bascules A et B d'un même
+    tick) partent en un seul message : une annonce fusionnable attend au plus
+    `coalesce` secondes en tête de file que ses sœurs la rejoignent.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, window: int = 500, coalesce: float = 0.05):
+        self.rate = rate
+        self.burst = burst
+        self.coalesce = coalesce
+        self._queues = {}  # channel_id -> _ChannelQueue
+        self._order = itertools.count()
+        self._latencies = deque(maxlen=window)  # secondes entre mise en file et envoi
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def _enqueue(self, channel, priority, content, kwargs, merge_key=None, deadline=None) -> asyncio.Future:
+        queue = self._queues.get(channel.id)
+        if queue is None:
+            queue = self._queues[channel.id] = _ChannelQueue(channel, self.burst)
+        queue.channel = channel
+
+        pending = queue.mergeable.get(merge_key) if merge_key is not None else None
+        if pending is not None:
+            pending.content = f"{pending.content}\n{content}"
+            self.merged += 1
+            return pending.future
+
+        item = _Outbound(priority, content, kwargs, merge_key, deadline)
+        heapq.heappush(queue.heap, (priority, next(self._order), item))
+        if merge_key is not None:
+            queue.mergeable[merge_key] = item
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.create_task(self._drain(queue))
+        return item.future
+
+    async def send(self, channel, content=None, **kwargs):
+        """Réponse à une commande : attend l'envoi et renvoie le message."""
+        return await self._enqueue(channel, REPLY, content, kwargs)
+
+    def post(self, channel, content: str, merge_key=None, deadline: float = None):
+        """Annonce sans attente ; ignorée si elle n'est pas partie avant `deadline` (epoch)."""
+        future = self._enqueue(channel, ANNOUNCEMENT, content, {}, merge_key, deadline)
+        future.add_done_callback(self._log_failure)
+
+    def _log_failure(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning(f"Annonce non envoyée : {future.exception()!r}")
+
+    async def _take_token(self, queue: _ChannelQueue):
+        while True:
+            now = time.monotonic()
+            queue.tokens = min(self.burst, queue.tokens + (now - queue.refilled_at) * self.rate)
+            queue.refilled_at = now
+            if queue.tokens >= 1:
+                queue.tokens -= 1
+                return
+            await asyncio.sleep((1 - queue.tokens) / self.rate)
+
+    async def _drain(self, queue: _ChannelQueue):
+        while queue.heap:
+            head = queue.heap[0][2]
+            if head.merge_key is not None:
+                wait = head.queued_at + self.coalesce - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+            await self._take_token(queue)
+            _, _, item = heapq.heappop(queue.heap)
+            if item.merge_key is not None:
+                queue.mergeable.pop(item.merge_key, None)
+            if item.future.done():
+                # Demandeur parti entre-temps : le jeton n'est pas consommé
+                queue.tokens += 1
+                continue
+            if item.deadline is not None and time.time() > item.deadline:
+                queue.tokens += 1
+                self.dropped += 1
+                item.future.set_result(None)
+                continue
+            try:
+                message = await queue.channel.send(item.content, **item.kwargs)
+            except Exception as exc:
+                self.failed += 1
+                if not item.future.done():
+                    item.future.set_exception(exc)
+                continue
+            self.sent += 1
+            self._latencies.append(time.monotonic() - item.queued_at)
+            if not item.future.done():
+                item.future.set_result(message)
+
+    def depth(self) -> int:
+        return sum(len(queue.heap) for queue in self._queues.values())
+
+    def latency(self) -> tuple:
+        """(p50, p99) du délai d'envoi en secondes sur les derniers messages."""
+        if not self._latencies:
+            return 0.0, 0.0
+        ordered = sorted(self._latencies)
+        def pick(q):
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return pick(0.50), pick(0.99)
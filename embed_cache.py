@@ -0,0 +1,37 @@
+# embed_cache.py
+
+import discord
+
+# ─── CACHE D'EMBEDS ────────────────────────────────────────────────────────────
+class EmbedCache:
+    """Embeds déjà rendus (stats, leaderboard), par serveur.
+
+    Chaque entrée est associée à la génération des données du serveur au moment
+    du rendu (`database.get_generation`) : dès qu'une écriture incrémente la
+    génération, l'entrée n'est plus servie.
+    """
+
+    def __init__(self):
+        self._entries = {}  # (guild_id, key) -> (generation, embed.to_dict())
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild_id: int, key: str, generation):
+        entry = self._entries.get((guild_id, key))
+        if entry is not None and entry[0] == generation:
+            self.hits += 1
+            return discord.Embed.from_dict(entry[1])
+        self.misses += 1
+        return None
+
+    def put(self, guild_id: int, key: str, generation, embed: discord.Embed):
+        self._entries[(guild_id, key)] = (generation, embed.to_dict())
+
+    def invalidate(self, guild_id: int):
+        for entry in [k for k in self._entries if k[0] == guild_id]:
+            del self._entries[entry]
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,129 @@
+# export.py
+"""Export de l'historique et des stats d'un serveur en NDJSON ou CSV compressés.
+
+Chaque table part dans son propre fichier .gz de DATA_DIR/exports, lu par lots
+et écrit au fil de l'eau (mémoire constante, quelle que soit la période).
+Utilisable depuis le bot (*export) ou en ligne de commande :
+
+    python export.py 123456789012345678 --format csv --since 2024-01-01
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import logging
+import time
+from datetime import date, datetime, time as dtime
+from pathlib import Path
+
+import database
+from database import DATA_DIR, EXPORT_TABLES
+
+logger = logging.getLogger('pomodoro_bot.export')
+
+EXPORT_DIR = Path(DATA_DIR) / 'exports'
+FORMATS = ('ndjson', 'csv')
+CHUNK = 1000
+
+_running = asyncio.Lock()  # un seul export à la fois
+
+def busy() -> bool:
+    return _running.locked()
+
+def parse_day(value: str) -> date:
+    """'YYYY-MM-DD' -> date (ValueError si invalide)."""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _local_midnight(day: date, tz) -> float:
+    return datetime.combine(day, dtime(0), tz).timestamp()
+
+# ─── ÉCRITURE ──────────────────────────────────────────────────────────────────
+class _GzipWriter:
+    """Fichier gzip ouvert et écrit hors de la boucle (via asyncio.to_thread)."""
+
+    def __init__(self, path: Path, fmt: str):
+        self.path = path
+        self.fmt = fmt
+        self.rows = 0
+        self._file = None
+        self._csv = None
+
+    def write(self, columns: list, rows: list):
+        if self._file is None:
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8', newline='')
+            if self.fmt == 'csv':
+                self._csv = csv.writer(self._file)
+                self._csv.writerow(columns)
+        if self.fmt == 'csv':
+            self._csv.writerows(rows)
+        else:
+            self._file.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+                                  for row in rows)
+        self.rows += len(rows)
+
+    def close(self):
+        if self._file is None:
+            # Table vide : fichier valide quand même (en-tête seul en CSV)
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8', newline='')
+        self._file.close()
+
+# ─── EXPORT ────────────────────────────────────────────────────────────────────
+async def export_guild(guild_id: int, fmt: str = 'ndjson', since: date = None,
+                       until: date = None, tables=EXPORT_TABLES, out_dir: Path = None) -> list:
+    """Exporte `tables` pour un serveur ; renvoie [(table, chemin, lignes)].
+
+    `since` (inclus) / `until` (exclu) sont des jours dans le fuseau du serveur ;
+    ils bornent session_logs et daily_user_totals.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Format inconnu : {fmt}")
+    out_dir = Path(out_dir) if out_dir is not None else EXPORT_DIR
+    async with _running:
+        # Les crédits encore en tampon font partie de l'export
+        await database.flush_writes()
+        await asyncio.to_thread(out_dir.mkdir, parents=True, exist_ok=True)
+        tz = await database.get_guild_timezone(guild_id)
+        start = _local_midnight(since, tz) if since is not None else None
+        end = _local_midnight(until, tz) if until is not None else None
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        results = []
+        for table in tables:
+            writer = _GzipWriter(out_dir / f"{guild_id}-{table}-{stamp}.{fmt}.gz", fmt)
+            try:
+                async for columns, rows in database.iter_export(guild_id, table, start, end, CHUNK):
+                    await asyncio.to_thread(writer.write, columns, rows)
+            finally:
+                await asyncio.to_thread(writer.close)
+            results.append((table, writer.path, writer.rows))
+            logger.info(f"Export {table} ({guild_id}) : {writer.rows} ligne(s) -> {writer.path}")
+        return results
+
+# ─── LIGNE DE COMMANDE ─────────────────────────────────────────────────────────
+def parse_args():
+    p = argparse.ArgumentParser(description="Export des données d'un serveur")
+    p.add_argument('guild_id', type=int)
+    p.add_argument('--format', choices=FORMATS, default='ndjson')
+    p.add_argument('--since', type=parse_day, help="début inclus (YYYY-MM-DD, fuseau du serveur)")
+    p.add_argument('--until', type=parse_day, help="fin exclue (YYYY-MM-DD, fuseau du serveur)")
+    p.add_argument('--tables', nargs='*', choices=EXPORT_TABLES, default=list(EXPORT_TABLES))
+    p.add_argument('--output-dir', type=Path, default=EXPORT_DIR)
+    return p.parse_args()
+
+async def run(args) -> list:
+    # Lecture seule : pas d'init_db (le bot peut tourner sur la même base)
+    try:
+        await database.load_settings()  # fuseau du serveur
+        return await export_guild(args.guild_id, args.format, args.since, args.until,
+                                  args.tables, args.output_dir)
+    finally:
+        await database.close_db()
+
+def main():
+    args = parse_args()
+    for table, path, rows in asyncio.run(run(args)):
+        print(f"{table:<18} {rows:>10} ligne(s)  {path}")
+
+if __name__ == '__main__':
+    main()
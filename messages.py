@@ -15,6 +15,7 @@ TEXT = {
     "missing_argument":   "❗ Argument manquant. Vérifiez la syntaxe de la commande.",
     "permission_denied":  "🚫 Permission refusée. Vous n'avez pas les droits requis.",
     "unexpected_error":   "❌ Erreur inattendue : {error}",
+    "leaderboard_stale":  "⌛ Cette page n'est plus valide. Relancez `{prefix}leaderboard`.",
 
     "already_joined":     "⚠️ Vous êtes déjà inscrit.",
     "not_registered":     "⚠️ Vous n'étiez pas inscrit.",
@@ -0,0 +1,189 @@
+# perf.py
+
+import functools
+import inspect
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from aiohttp import web
+
+logger = logging.getLogger('pomodoro_bot.perf')
+
+# Bornes des buckets (secondes), comme les histogrammes Prometheus par défaut
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+WINDOW = 1024  # derniers échantillons gardés pour les percentiles glissants
+
+# ─── HISTOGRAMMES & COMPTEURS ──────────────────────────────────────────────────
+class Histogram:
+    """Buckets cumulés depuis le démarrage + fenêtre glissante pour p50/p99."""
+
+    __slots__ = ('counts', 'total', 'count', 'recent')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=WINDOW)
+
+    def observe(self, seconds: float):
+        self.total += seconds
+        self.count += 1
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def percentile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+_histograms = {}  # (famille, label) -> Histogram
+_counters = {}    # (nom, label) -> int
+_gauges = {}      # nom -> fonction sans argument
+_started = time.time()
+
+def observe(family: str, label: str, seconds: float):
+    hist = _histograms.get((family, label))
+    if hist is None:
+        hist = _histograms[(family, label)] = Histogram()
+    hist.observe(seconds)
+
+def inc(name: str, label: str = '', amount: int = 1):
+    _counters[(name, label)] = _counters.get((name, label), 0) + amount
+
+def gauge(name: str, fn):
+    """Valeur lue au moment de l'export (profondeur d'une file, etc.)."""
+    _gauges[name] = fn
+
+@contextmanager
+def timer(family: str, label: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(family, label, time.perf_counter() - start)
+
+def timed(family: str, label: str = None):
+    """Décorateur pour coroutines : chaque appel alimente l'histogramme (family, label)."""
+    def wrap(fn):
+        name = label or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception:
+                inc(f'{family}_errors', name)
+                raise
+            finally:
+                observe(family, name, time.perf_counter() - start)
+        wrapper.__perf_wrapped__ = True
+        return wrapper
+    return wrap
+
+def instrument_module(module, family: str):
+    """Enveloppe toutes les coroutines publiques définies dans `module`."""
+    for name, fn in list(vars(module).items()):
+        if (name.startswith('_') or not inspect.iscoroutinefunction(fn)
+                or fn.__module__ != module.__name__ or getattr(fn, '__perf_wrapped__', False)):
+            continue
+        setattr(module, name, timed(family, name)(fn))
+
+def instrument_http(http):
+    """Chronomètre chaque requête REST de discord.py (HTTPClient.request)."""
+    original = http.request
+
+    async def request(route, **kwargs):
+        # Chemin non résolu (/channels/{channel_id}/messages) : cardinalité bornée
+        label = f"{route.method} {route.path}"
+        start = time.perf_counter()
+        try:
+            return await original(route, **kwargs)
+        except Exception:
+            inc('discord_http_errors', label)
+            raise
+        finally:
+            observe('discord_http', label, time.perf_counter() - start)
+
+    http.request = request
+
+# ─── LECTURE ───────────────────────────────────────────────────────────────────
+def snapshot(family: str) -> list:
+    """[(label, count, p50, p99)] d'une famille, p99 décroissant."""
+    rows = [(label, hist.count, hist.percentile(0.50), hist.percentile(0.99))
+            for (fam, label), hist in _histograms.items() if fam == family]
+    return sorted(rows, key=lambda r: r[3], reverse=True)
+
+def counter(name: str) -> int:
+    return sum(v for (n, _), v in _counters.items() if n == name)
+
+def uptime() -> float:
+    return time.time() - _started
+
+def _label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_prometheus(prefix: str = 'pomobot') -> str:
+    """Export au format texte Prometheus 0.0.4."""
+    lines = []
+    families = sorted({fam for fam, _ in _histograms})
+    for fam in families:
+        metric = f'{prefix}_{fam}_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        for (f, label), hist in sorted(_histograms.items()):
+            if f != fam:
+                continue
+            name = f'name="{_label(label)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{name},le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{name},le="+Inf"}} {hist.count}')
+            lines.append(f'{metric}_sum{{{name}}} {hist.total:.6f}')
+            lines.append(f'{metric}_count{{{name}}} {hist.count}')
+    for counter_name in sorted({n for n, _ in _counters}):
+        metric = f'{prefix}_{counter_name}_total'
+        lines.append(f'# TYPE {metric} counter')
+        for (n, label), value in sorted(_counters.items()):
+            if n == counter_name:
+                lines.append(f'{metric}{{name="{_label(label)}"}} {value}')
+    for gauge_name, fn in sorted(_gauges.items()):
+        try:
+            value = float(fn())
+        except Exception:
+            logger.exception(f"Gauge {gauge_name} illisible")
+            continue
+        lines.append(f'# TYPE {prefix}_{gauge_name} gauge')
+        lines.append(f'{prefix}_{gauge_name} {value}')
+    lines.append(f'# TYPE {prefix}_uptime_seconds gauge')
+    lines.append(f'{prefix}_uptime_seconds {uptime():.0f}')
+    return '\n'.join(lines) + '\n'
+
+# ─── SERVEUR HTTP ──────────────────────────────────────────────────────────────
+async def start_metrics_server(port: int, host: str = '0.0.0.0'):
+    """Sert /metrics sur `port` ; renvoie le runner aiohttp (à nettoyer à l'arrêt).
+
+    Port indisponible : avertissement et None, le bot tourne sans /metrics.
+    """
+    async def metrics(request):
+        return web.Response(text=render_prometheus(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.warning(f"Métriques Prometheus désactivées ({host}:{port}) : {e}")
+        await runner.cleanup()
+        return None
+    logger.info(f"Métriques Prometheus sur http://{host}:{port}/metrics")
+    return runner
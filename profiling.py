@@ -0,0 +1,177 @@
+# profiling.py
+
+import asyncio
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+from database import DATA_DIR
+
+logger = logging.getLogger('pomodoro_bot.profiling')
+
+PROFILE_DIR = Path(DATA_DIR) / 'profiles'
+MAX_SECONDS = 300
+# Fonctions mises en avant dans les résumés : chemin des ticks et rendu des classements.
+# (fichier, fonction) : un simple nom attraperait aussi discord.py, asyncio...
+FOCUS = frozenset({
+    ('bot.py', 'on_boundaries'), ('bot.py', 'tick_guild'), ('bot.py', 'announce'),
+    ('database.py', 'ajouter_temps_many'), ('bot.py', 'leaderboard'),
+    ('database.py', 'get_top'), ('usernames.py', 'resolve'), ('bot.py', 'stats'),
+})
+_REPO = Path(__file__).resolve().parent
+
+_running = asyncio.Lock()  # un seul profil à la fois
+
+def busy() -> bool:
+    return _running.locked()
+
+def _output(kind: str, suffix: str) -> Path:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    return PROFILE_DIR / f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{suffix}"
+
+def _is_focus(filename: str, func: str) -> bool:
+    path = Path(filename)
+    return (path.name, func) in FOCUS and path.resolve().parent == _REPO
+
+# ─── cPROFILE ──────────────────────────────────────────────────────────────────
+async def profile_cpu(seconds: float, top: int = 10) -> dict:
+    """cProfile déterministe du thread de la boucle pendant `seconds`.
+
+    Renvoie {'path', 'top': [(fonction, appels, tottime, cumtime)], 'focus': [...]}.
+    """
+    async with _running:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+
+        path = _output('cpu', 'prof')
+        await asyncio.to_thread(profiler.dump_stats, str(path))
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        rows = [(f"{Path(file).name}:{line}:{func}", calls, tottime, cumtime)
+                for (file, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items()]
+        focus = [row for row, (file, _, func) in zip(rows, stats.stats) if _is_focus(file, func)]
+        return {
+            'path': path,
+            'top': sorted(rows, key=lambda r: r[2], reverse=True)[:top],
+            'focus': sorted(focus, key=lambda r: r[3], reverse=True)[:top],
+        }
+
+# ─── ÉCHANTILLONNAGE ───────────────────────────────────────────────────────────
+class _Sampler(threading.Thread):
+    """Relève la pile du thread de la boucle toutes les `interval` secondes."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name='pomobot-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # "fichier:fonction;..." (racine d'abord) -> échantillons
+        self.samples = 0
+        self.focus_names = set()  # entrées de la pile qui sont des fonctions de FOCUS
+        self._names = {}  # code -> "fichier:fonction", calculé une fois par fonction
+        self._stop_event = threading.Event()
+
+    def _label(self, code) -> str:
+        name = self._names[code] = f"{Path(code.co_filename).name}:{code.co_name}"
+        if _is_focus(code.co_filename, code.co_name):
+            self.focus_names.add(name)
+        return name
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._names.get(frame.f_code) or self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def _write_collapsed(path: Path, stacks: Counter):
+    # Format « piles repliées », lisible par flamegraph.pl / speedscope
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+async def profile_sampling(seconds: float, interval: float = 0.005, top: int = 10) -> dict:
+    """Profil par échantillonnage, quasi sans surcoût pour la boucle.
+
+    Renvoie {'path', 'samples', 'self': [(fonction, part)], 'inclusive': [...], 'focus': [...]}.
+    """
+    async with _running:
+        sampler = _Sampler(threading.get_ident(), interval)
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(sampler.stop)
+
+        path = _output('sample', 'folded')
+        await asyncio.to_thread(_write_collapsed, path, sampler.stacks)
+
+        own, inclusive = Counter(), Counter()
+        for stack, count in sampler.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                inclusive[name] += count
+        total = sampler.samples or 1
+
+        def share(counter):
+            return [(name, count / total) for name, count in counter.most_common(top)]
+
+        focus = Counter({name: count for name, count in inclusive.items()
+                         if name in sampler.focus_names})
+        return {'path': path, 'samples': sampler.samples,
+                'self': share(own), 'inclusive': share(inclusive), 'focus': share(focus)}
+
+# ─── MÉMOIRE ───────────────────────────────────────────────────────────────────
+def _write_diff(path: Path, diff: list):
+    with open(path, 'w', encoding='utf-8') as f:
+        for stat in diff:
+            f.write(f"{stat}\n")
+            for line in stat.traceback.format():
+                f.write(f"    {line}\n")
+
+async def profile_memory(seconds: float, top: int = 10) -> dict:
+    """Différence de deux instantanés tracemalloc pris à `seconds` d'intervalle.
+
+    Renvoie {'path', 'growth' (octets), 'top': [(site, écart en octets, écart en blocs)]}.
+    """
+    async with _running:
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(25)
+        try:
+            before = tracemalloc.take_snapshot()
+            await asyncio.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+        diff = await asyncio.to_thread(after.compare_to, before, 'lineno')
+        path = _output('mem', 'txt')
+        await asyncio.to_thread(_write_diff, path, diff)
+
+        rows = []
+        for stat in diff[:top]:
+            frame = stat.traceback[0]
+            rows.append((f"{Path(frame.filename).name}:{frame.lineno}", stat.size_diff, stat.count_diff))
+        return {'path': path, 'growth': sum(stat.size_diff for stat in diff), 'top': rows}
@@ -0,0 +1,232 @@
+# ranking.py
+
+from bisect import bisect_left, bisect_right, insort
+
+# ─── MÉTRIQUES DE CLASSEMENT ───────────────────────────────────────────────────
+# nom -> (expression SQL sur `stats`, filtre SQL, index dédié, calcul Python)
+# Le calcul Python s'applique à une ligne
+# (user_id, total_seconds, work_seconds_A, work_seconds_B, session_count)
+METRICS = {
+    'total':    ('total_seconds',  '1', 'idx_stats_total_seconds',  lambda r: r[1]),
+    'A':        ('work_seconds_A', '1', 'idx_stats_work_seconds_A', lambda r: r[2]),
+    'B':        ('work_seconds_B', '1', 'idx_stats_work_seconds_B', lambda r: r[3]),
+    'sessions': ('session_count',  '1', 'idx_stats_session_count',  lambda r: r[4]),
+    # Moyenne par session, seulement à partir de 10 sessions
+    'avg':      ('total_seconds / session_count', 'session_count >= 10', 'idx_stats_avg',
+                 lambda r: r[1] // r[4] if r[4] >= 10 else None),
+}
+
+# Métriques dont la valeur d'un utilisateur ne fait que croître
+MONOTONIC = {'total', 'A', 'B', 'sessions'}
+
+TOP_K = 10
+
+# ─── TOP-K ─────────────────────────────────────────────────────────────────────
+class TopK:
+    """Les K meilleures valeurs d'une métrique pour un serveur.
+
+    Chargé une fois depuis la base (requête indexée), puis tenu à jour à chaque
+    écriture de stats. `update` renvoie False quand la structure ne peut plus
+    garantir son contenu (une valeur du top a baissé alors que des utilisateurs
+    hors du top existent) : il faut alors la recharger.
+    """
+
+    def __init__(self, k: int, rows: list):
+        self.k = k
+        self._values = {user_id: value for user_id, value in rows}
+        # Tant que la structure contient tout le serveur, une baisse est sans risque
+        self.complete = len(self._values) < k
+
+    def _floor(self):
+        return min(self._values.items(), key=lambda kv: (kv[1], kv[0]))
+
+    def update(self, user_id: int, value) -> bool:
+        if value is None:
+            if user_id in self._values:
+                del self._values[user_id]
+                return self.complete
+            return True
+        if user_id in self._values:
+            old = self._values[user_id]
+            self._values[user_id] = value
+            return value >= old or self.complete
+        if len(self._values) < self.k:
+            self._values[user_id] = value
+            return True
+        floor_uid, floor_value = self._floor()
+        self.complete = False
+        # Départage des égalités comme les index : le plus grand user_id passe devant
+        if (value, user_id) > (floor_value, floor_uid):
+            del self._values[floor_uid]
+            self._values[user_id] = value
+        return True
+
+    def top(self, n: int) -> list:
+        # Même ordre que les index : valeur puis user_id décroissants
+        ordered = sorted(self._values.items(), key=lambda kv: (-kv[1], -kv[0]))
+        return ordered[:n]
+
+# ─── RANGS ─────────────────────────────────────────────────────────────────────
+class _SortedChunks:
+    """Liste triée découpée en tronçons d'au plus 2 × `load` éléments.
+
+    Insertion et suppression ne déplacent qu'un tronçon : le coût ne dépend plus
+    de la taille du serveur, contrairement à un insort dans une seule liste.
+    """
+
+    def __init__(self, items: list, load: int = 1000):
+        self.load = load
+        self._lists = [items[i:i + load] for i in range(0, len(items), load)]
+        self._maxes = [chunk[-1] for chunk in self._lists]
+        self._len = len(items)
+
+    def add(self, key):
+        self._len += 1
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._lists[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._lists[i], key)
+        chunk = self._lists[i]
+        if len(chunk) > 2 * self.load:
+            self._lists.insert(i + 1, chunk[self.load:])
+            del chunk[self.load:]
+            self._maxes.insert(i, chunk[-1])
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        chunk = self._lists[i]
+        j = bisect_left(chunk, key)
+        del chunk[j]
+        self._len -= 1
+        if not chunk:
+            del self._lists[i]
+            del self._maxes[i]
+        elif j == len(chunk):
+            self._maxes[i] = chunk[-1]
+
+    def count_above(self, key) -> int:
+        """Nombre d'éléments strictement supérieurs à `key`."""
+        i = bisect_right(self._maxes, key)
+        if i == len(self._lists):
+            return 0
+        chunk = self._lists[i]
+        return len(chunk) - bisect_right(chunk, key) + sum(map(len, self._lists[i + 1:]))
+
+    def __len__(self) -> int:
+        return self._len
+
+class RankIndex:
+    """Toutes les valeurs d'une métrique pour un serveur, triées.
+
+    (valeur, user_id) croissants dans une liste par tronçons : le rang d'un
+    utilisateur se lit par bisection, dans le même ordre que les classements
+    (valeur puis user_id décroissants). Une mise à jour déplace une seule entrée,
+    dans un seul tronçon. Seules les valeurs strictement positives sont classées :
+    sans temps, pas de rang.
+    """
+
+    def __init__(self, rows: list, load: int = 1000):
+        self._values = {user_id: value for user_id, value in rows if value}
+        self._keys = _SortedChunks(sorted((value, user_id) for user_id, value in self._values.items()),
+                                   load)
+
+    def update(self, user_id: int, value):
+        if value is not None and value <= 0:
+            value = None
+        old = self._values.get(user_id)
+        if old == value:
+            return  # ex. temps B d'un membre crédité en mode A
+        if old is not None:
+            del self._values[user_id]
+            self._keys.remove((old, user_id))
+        if value is not None:
+            self._values[user_id] = value
+            self._keys.add((value, user_id))
+
+    def rank(self, user_id: int):
+        """Rang (1 = premier), None si l'utilisateur n'est pas classé."""
+        value = self._values.get(user_id)
+        if value is None:
+            return None
+        return self._keys.count_above((value, user_id)) + 1
+
+    def rank_of(self, user_id: int, value):
+        """(rang, classés) si l'utilisateur avait `value`, sans modifier l'index.
+
+        Sert à classer des valeurs plus fraîches que l'index (crédits encore en
+        tampon). None si `value` n'est pas classable.
+        """
+        if value is None or value <= 0:
+            return None
+        key = (value, user_id)
+        old = self._values.get(user_id)
+        above, total = self._keys.count_above(key), len(self._keys)
+        if old is None:
+            total += 1
+        elif (old, user_id) > key:
+            above -= 1  # son ancienne entrée n'est pas un concurrent
+        return above + 1, total
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+class Leaderboards:
+    """Registre des TopK et des RankIndex par (guild_id, métrique)."""
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self._boards = {}
+        self._ranks = {}
+        # Serveurs ayant au moins une structure chargée (sur-ensemble : un TopK
+        # abandonné par observe n'en retire pas son serveur)
+        self._guilds = set()
+
+    def get(self, guild_id: int, metric: str):
+        return self._boards.get((guild_id, metric))
+
+    def load(self, guild_id: int, metric: str, rows: list) -> TopK:
+        board = TopK(self.k, rows)
+        self._boards[(guild_id, metric)] = board
+        self._guilds.add(guild_id)
+        return board
+
+    def get_ranks(self, guild_id: int, metric: str):
+        return self._ranks.get((guild_id, metric))
+
+    def load_ranks(self, guild_id: int, metric: str, rows: list) -> RankIndex:
+        index = RankIndex(rows)
+        self._ranks[(guild_id, metric)] = index
+        self._guilds.add(guild_id)
+        return index
+
+    def has_guild(self, guild_id: int) -> bool:
+        return guild_id in self._guilds
+
+    def observe(self, guild_id: int, rows: list):
+        """Applique les valeurs absolues de lignes `stats` fraîchement écrites."""
+        for metric, (_, _, _, compute) in METRICS.items():
+            index = self._ranks.get((guild_id, metric))
+            if index is not None:
+                for row in rows:
+                    index.update(row[0], compute(row))
+            board = self._boards.get((guild_id, metric))
+            if board is None:
+                continue
+            for row in rows:
+                if not board.update(row[0], compute(row)):
+                    del self._boards[(guild_id, metric)]
+                    break
+
+    def invalidate(self, guild_id: int):
+        self._guilds.discard(guild_id)
+        for key in [k for k in self._boards if k[0] == guild_id]:
+            del self._boards[key]
+        for key in [k for k in self._ranks if k[0] == guild_id]:
+            del self._ranks[key]
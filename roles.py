@@ -0,0 +1,106 @@
+# roles.py
+
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger('pomodoro_bot.roles')
+
+# ─── FILE D'OPÉRATIONS SUR LES RÔLES ───────────────────────────────────────────
+class RoleQueue:
+    """Ajouts/retraits de rôles appliqués en arrière-plan.
+
+    Les commandes déposent une demande et répondent tout de suite. Pour un même
+    (membre, rôle), seule la dernière demande compte : un ajout suivi d'un
+    retrait avant exécution ne coûte qu'un appel. Chaque serveur a son propre
+    worker, avec un nombre borné d'appels simultanés : les routes de rôles de
+    Discord sont limitées par serveur, et le client HTTP de discord.py attend
+    déjà la fin des 429 de chaque bucket.
+
+    `add`/`remove` renvoient un futur résolu quand l'opération est appliquée
+    (partagé par les demandes fusionnées) ; un échec y est posé en exception,
+    sans interrompre le reste de la file.
+    """
+
+    def __init__(self, bot, concurrency: int = 4):
+        self.bot = bot
+        self.concurrency = concurrency
+        self._pending = {}  # guild_id -> {(user_id, role_id): (True ajout / False retrait, futur)}
+        self._workers = {}  # guild_id -> asyncio.Task
+        self.applied = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def _enqueue(self, guild_id: int, user_id: int, role_id: int, add: bool) -> asyncio.Future:
+        ops = self._pending.setdefault(guild_id, {})
+        key = (user_id, role_id)
+        if key in ops:
+            self.coalesced += 1
+            future = ops[key][1]
+        else:
+            future = asyncio.get_running_loop().create_future()
+        ops[key] = (add, future)
+        worker = self._workers.get(guild_id)
+        if worker is None or worker.done():
+            self._workers[guild_id] = asyncio.create_task(self._drain(guild_id))
+        return future
+
+    def add(self, guild_id: int, user_id: int, role: discord.Role) -> asyncio.Future:
+        return self._enqueue(guild_id, user_id, role.id, True)
+
+    def remove(self, guild_id: int, user_id: int, role: discord.Role) -> asyncio.Future:
+        return self._enqueue(guild_id, user_id, role.id, False)
+
+    def clear_role(self, role: discord.Role, keep=()):
+        """Retire `role` à ses porteurs (hors `keep`), sans parcourir tout le serveur."""
+        for member in role.members:
+            if member.id not in keep:
+                self.remove(role.guild.id, member.id, role)
+
+    def pending(self) -> int:
+        return sum(len(ops) for ops in self._pending.values())
+
+    async def _apply(self, guild_id: int, user_id: int, role_id: int, add: bool,
+                     future: asyncio.Future, slots: asyncio.Semaphore):
+        async with slots:
+            try:
+                if add:
+                    await self.bot.http.add_role(guild_id, user_id, role_id)
+                else:
+                    await self.bot.http.remove_role(guild_id, user_id, role_id)
+                self.applied += 1
+            except discord.NotFound:
+                # Membre parti ou rôle supprimé entre-temps
+                pass
+            except Exception as err:
+                self.failed += 1
+                if isinstance(err, discord.HTTPException):
+                    logger.warning(f"Rôle {role_id} ({'ajout' if add else 'retrait'}) "
+                                   f"pour {user_id} sur {guild_id} : {err}")
+                else:
+                    logger.exception(f"Rôle {role_id} ({'ajout' if add else 'retrait'}) "
+                                     f"pour {user_id} sur {guild_id}")
+                if not future.done():
+                    future.set_exception(err)
+                    # Déjà journalisé : pas d'avertissement si personne n'attend le futur
+                    future.exception()
+                return
+        if not future.done():
+            future.set_result(None)
+
+    async def _drain(self, guild_id: int):
+        slots = asyncio.Semaphore(self.concurrency)
+        ops = self._pending[guild_id]
+        # Les demandes arrivées pendant un lot partent au lot suivant
+        while ops:
+            batch = list(ops.items())
+            ops.clear()
+            await asyncio.gather(*(self._apply(guild_id, user_id, role_id, add, future, slots)
+                                   for (user_id, role_id), (add, future) in batch))
+        del self._pending[guild_id]
+
+    async def join(self):
+        """Attend que toutes les demandes en cours soient appliquées."""
+        while workers := [w for w in self._workers.values() if not w.done()]:
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,132 @@
+# scheduler.py
+
+import asyncio
+import logging
+import time
+from typing import NamedTuple
+
+logger = logging.getLogger('pomodoro_bot.scheduler')
+
+# ─── CYCLES ────────────────────────────────────────────────────────────────────
+class Boundary(NamedTuple):
+    """Une bascule de phase : à `ts`, le mode `mode` entre en phase `phase`."""
+    ts: float
+    mode: str
+    phase: str        # 'travail' ou 'pause'
+    index: int        # rang du cycle dans l'heure (0 = premier)
+    per_hour: int     # nombre de cycles par heure
+
+class Cycle:
+    """Cycle travail/pause calé sur l'epoch UTC (donc sur les heures pleines).
+
+    Mode A 50/10 : bascules à XX:00 et XX:50.
+    Mode B 25/5  : bascules à XX:00, XX:25, XX:30 et XX:55.
+    """
+
+    def __init__(self, mode: str, work: int, brk: int):
+        self.mode = mode
+        self.work = work
+        self.brk = brk
+        self.period = (work + brk) * 60
+        self.per_hour = 3600 // self.period if 3600 % self.period == 0 else 1
+
+    def _index(self, cycle_start: float) -> int:
+        return int(cycle_start // self.period) % self.per_hour
+
+    def phase_at(self, ts: float) -> tuple:
+        """(phase, secondes restantes) à l'instant `ts`."""
+        pos = ts % self.period
+        if pos < self.work * 60:
+            return 'travail', int(self.work * 60 - pos)
+        return 'pause', int(self.period - pos)
+
+    def boundaries(self, start: float, end: float) -> list:
+        """Bascules dans l'intervalle ]start, end]."""
+        out = []
+        cycle_start = start - start % self.period
+        while cycle_start <= end:
+            for offset, phase in ((0, 'travail'), (self.work * 60, 'pause')):
+                ts = cycle_start + offset
+                if start < ts <= end:
+                    out.append(Boundary(ts, self.mode, phase,
+                                        self._index(cycle_start), self.per_hour))
+            cycle_start += self.period
+        return out
+
+    def next_boundary(self, after: float) -> float:
+        cycle_start = after - after % self.period
+        if cycle_start + self.work * 60 > after:
+            return cycle_start + self.work * 60
+        return cycle_start + self.period
+
+    def minutes(self) -> set:
+        """Minutes de l'heure où ce cycle bascule."""
+        out = set()
+        for start in range(0, 3600, self.period):
+            out.add(start // 60 % 60)
+            out.add((start + self.work * 60) // 60 % 60)
+        return out
+
+# ─── PLANIFICATEUR ─────────────────────────────────────────────────────────────
+class PhaseScheduler:
+    """Réveille le bot exactement aux bascules de phase.
+
+    Au lieu d'interroger l'horloge chaque minute, on calcule la prochaine
+    bascule de tous les cycles et on dort jusqu'à cette échéance. Le sommeil
+    est recalé sur l'horloge murale (correction de dérive) et, si la boucle
+    d'événements a pris du retard, toutes les bascules manquées sont livrées
+    d'un coup au callback, dans l'ordre.
+    """
+
+    def __init__(self, cycles, callback):
+        self.cycles = list(cycles)
+        self.callback = callback
+        self._task = None
+        self.wakeups = 0
+        self.last_lateness = 0.0  # retard du dernier réveil, en secondes
+
+    def next_deadline(self, after: float) -> float:
+        return min(cycle.next_boundary(after) for cycle in self.cycles)
+
+    def boundaries(self, start: float, end: float) -> list:
+        due = [b for cycle in self.cycles for b in cycle.boundaries(start, end)]
+        return sorted(due)
+
+    def minutes(self) -> set:
+        return set().union(*(cycle.minutes() for cycle in self.cycles))
+
+    async def _sleep_until(self, deadline: float):
+        # asyncio dort sur l'horloge monotone : on revérifie l'horloge murale
+        while (remaining := deadline - time.time()) > 0:
+            await asyncio.sleep(remaining)
+
+    async def _run(self, since: float = None):
+        last = since if since is not None else time.time()
+        while True:
+            await self._sleep_until(self.next_deadline(last))
+            now = time.time()
+            self.wakeups += 1
+            due = self.boundaries(last, now)
+            last = now
+            if not due:
+                continue
+            self.last_lateness = now - due[-1].ts
+            if len({b.ts for b in due}) > 1 or self.last_lateness > 1:
+                logger.info(f"{len(due)} bascule(s) traitée(s) avec {self.last_lateness:.3f}s de retard")
+            try:
+                await self.callback(due)
+            except Exception:
+                logger.exception("Erreur lors du traitement des bascules")
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, since: float = None):
+        """Démarre la boucle ; les bascules postérieures à `since` (défaut : maintenant) sont livrées."""
+        if not self.is_running():
+            self._task = asyncio.create_task(self._run(since))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
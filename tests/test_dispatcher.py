@@ -0,0 +1,48 @@
+# tests/test_dispatcher.py
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dispatcher import Dispatcher
+
+class FakeChannel:
+    id = 1
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, content, **kwargs):
+        self.sent.append(content)
+        return content
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def test_announcements_merged_across_await(self):
+        # Annonce B postée après un await (résolution de rôle) : même message que A
+        chan = FakeChannel()
+        outbox = Dispatcher(rate=100, burst=5, coalesce=0.05)
+        outbox.post(chan, "A", merge_key=3600)
+        await asyncio.sleep(0.01)
+        outbox.post(chan, "B", merge_key=3600)
+        await asyncio.sleep(0.2)
+        self.assertEqual(chan.sent, ["A\nB"])
+        self.assertEqual((outbox.sent, outbox.merged), (1, 1))
+
+    async def test_distinct_keys_sent_separately(self):
+        chan = FakeChannel()
+        outbox = Dispatcher(rate=100, burst=5, coalesce=0.01)
+        outbox.post(chan, "A", merge_key=1)
+        outbox.post(chan, "B", merge_key=2)
+        await asyncio.sleep(0.1)
+        self.assertEqual(chan.sent, ["A", "B"])
+
+    async def test_replies_not_delayed_by_coalescing(self):
+        chan = FakeChannel()
+        outbox = Dispatcher(rate=100, burst=5, coalesce=10)
+        self.assertEqual(await asyncio.wait_for(outbox.send(chan, "pong"), 1), "pong")
+
+if __name__ == '__main__':
+    unittest.main()
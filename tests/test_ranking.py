@@ -0,0 +1,92 @@
+# tests/test_ranking.py
+
+import random
+import sqlite3
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ranking import RankIndex, TopK
+
+def sql_top(values: dict, n: int) -> list:
+    """Référence : même tri que get_top (valeur puis user_id décroissants)."""
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE stats (user_id INTEGER, value INTEGER)")
+    db.executemany("INSERT INTO stats VALUES (?, ?)", values.items())
+    rows = db.execute("SELECT user_id, value FROM stats ORDER BY value DESC, user_id DESC LIMIT ?",
+                      (n,)).fetchall()
+    db.close()
+    return rows
+
+class TopKTest(unittest.TestCase):
+    def test_tie_at_floor_higher_user_id_enters(self):
+        board = TopK(2, [(10, 5), (3, 5)])
+        self.assertTrue(board.update(20, 5))
+        self.assertEqual(board.top(2), [(20, 5), (10, 5)])
+        self.assertEqual(board.top(2), sql_top({10: 5, 3: 5, 20: 5}, 2))
+
+    def test_tie_at_floor_lower_user_id_stays_out(self):
+        board = TopK(2, [(10, 5), (3, 5)])
+        self.assertTrue(board.update(1, 5))
+        self.assertEqual(board.top(2), [(10, 5), (3, 5)])
+
+    def test_floor_user_falling_below_board_requires_reload(self):
+        # Des utilisateurs hors du top existent : la baisse du plancher est invérifiable
+        board = TopK(2, [(10, 7), (3, 5)])
+        board.update(20, 4)
+        self.assertFalse(board.update(3, 1))
+
+    def test_floor_user_falling_in_complete_board(self):
+        board = TopK(3, [(10, 7), (3, 5)])
+        self.assertTrue(board.update(3, 1))
+        self.assertEqual(board.top(3), [(10, 7), (3, 1)])
+
+class RankIndexTest(unittest.TestCase):
+    def test_ranks_match_sql_after_interleaved_updates(self):
+        rng = random.Random(23)
+        db = sqlite3.connect(':memory:')
+        db.execute("CREATE TABLE stats (user_id INTEGER PRIMARY KEY, value INTEGER)")
+        db.executemany("INSERT INTO stats VALUES (?, ?)",
+                       [(uid, rng.randint(0, 50)) for uid in range(300)])
+        # Petits tronçons : découpes et tronçons vidés arrivent vite
+        index = RankIndex(db.execute("SELECT user_id, value FROM stats").fetchall(), load=8)
+
+        def sql_rank(uid):
+            value = db.execute("SELECT value FROM stats WHERE user_id=?", (uid,)).fetchone()
+            if value is None or not value[0] > 0:
+                return None
+            above = db.execute("""
+                SELECT COUNT(*) FROM stats
+                WHERE value > 0 AND (value > :v OR (value = :v AND user_id > :u))
+            """, {'v': value[0], 'u': uid}).fetchone()[0]
+            return above + 1
+
+        for step in range(3000):
+            uid = rng.randrange(400)
+            if rng.random() < 0.1:
+                db.execute("DELETE FROM stats WHERE user_id=?", (uid,))
+                index.update(uid, None)
+            else:
+                value = rng.randint(0, 50)
+                db.execute("INSERT OR REPLACE INTO stats VALUES (?, ?)", (uid, value))
+                index.update(uid, value)
+            probe = rng.randrange(400)
+            self.assertEqual(index.rank(probe), sql_rank(probe), f"étape {step}, user {probe}")
+        self.assertEqual([index.rank(uid) for uid in range(400)], [sql_rank(uid) for uid in range(400)])
+        self.assertEqual(len(index), db.execute("SELECT COUNT(*) FROM stats WHERE value > 0").fetchone()[0])
+        db.close()
+
+    def test_rank_of_matches_rank_after_update(self):
+        rng = random.Random(7)
+        rows = [(uid, rng.randint(0, 20)) for uid in range(60)]
+        for uid, value in [(5, 30), (5, 0), (5, None), (70, 10), (3, rng.randint(1, 20))]:
+            index = RankIndex(rows, load=4)
+            preview = index.rank_of(uid, value)
+            index.update(uid, value)
+            expected = (index.rank(uid), len(index)) if index.rank(uid) is not None else None
+            self.assertEqual(preview, expected, (uid, value))
+
+if __name__ == '__main__':
+    unittest.main()
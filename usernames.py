@@ -0,0 +1,91 @@
+# usernames.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import discord
+
+from database import get_user_names, save_user_names
+
+logger = logging.getLogger('pomodoro_bot.usernames')
+
+UNKNOWN_NAME = "Utilisateur inconnu"
+
+# ─── RÉSOLUTION DES NOMS ───────────────────────────────────────────────────────
+class NameResolver:
+    """Résout des user_id en noms pour l'affichage des classements.
+
+    Ordre de recherche : cache des membres du serveur, cache LRU+TTL en mémoire,
+    table `user_names`, puis `fetch_user` en parallèle (borné) pour les seuls
+    identifiants encore inconnus.
+    """
+
+    def __init__(self, bot, maxsize: int = 5000, ttl: float = 6 * 3600,
+                 stored_ttl: float = 7 * 86400, concurrency: int = 5):
+        self.bot = bot
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stored_ttl = stored_ttl
+        self._cache = OrderedDict()  # user_id -> (name, expires_at)
+        self._fetch_slots = asyncio.Semaphore(concurrency)
+
+    def _remember(self, user_id: int, name: str):
+        self._cache[user_id] = (name, time.monotonic() + self.ttl)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def _cached(self, user_id: int):
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return None
+        name, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._cache[user_id]
+            return None
+        self._cache.move_to_end(user_id)
+        return name
+
+    async def _fetch(self, user_id: int):
+        async with self._fetch_slots:
+            try:
+                return (await self.bot.fetch_user(user_id)).name
+            except discord.HTTPException:
+                logger.warning(f"fetch_user({user_id}) a échoué")
+                return None
+
+    async def resolve(self, guild: discord.Guild, user_ids) -> dict:
+        names, missing = {}, []
+        for user_id in dict.fromkeys(user_ids):
+            member = guild.get_member(user_id) if guild else None
+            name = member.name if member else self._cached(user_id)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        if not missing:
+            return names
+
+        stored = await get_user_names(missing)
+        now = time.time()
+        to_fetch = []
+        for user_id in missing:
+            name, updated_at = stored.get(user_id, (None, 0))
+            if name is not None and now - updated_at < self.stored_ttl:
+                names[user_id] = name
+                self._remember(user_id, name)
+            else:
+                to_fetch.append(user_id)
+
+        fetched = {}
+        results = await asyncio.gather(*(self._fetch(user_id) for user_id in to_fetch))
+        for user_id, name in zip(to_fetch, results):
+            if name is not None:
+                fetched[user_id] = name
+                self._remember(user_id, name)
+            # Nom périmé plutôt que rien si Discord ne répond pas
+            names[user_id] = name or stored.get(user_id, (UNKNOWN_NAME,))[0]
+        await save_user_names(fetched)
+        return names